@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import gzip
+import json
+
+from werkzeug.exceptions import Forbidden
+
 from odoo import http, SUPERUSER_ID
-from odoo.http import request
+from odoo.http import request, Response
 from odoo.api import Environment
 from odoo.modules.registry import Registry
 
@@ -21,16 +26,26 @@ class TaskLogController(http.Controller):
         'code',
         'data',
         'total',
-        'parent_id'
+        'parent_id',
+        'count',
+        'date_start',
+        'date_end',
+        'wall_time',
+        'cpu_time',
+        'sql_count'
     }
 
     INT_FIELDS = {
         'task_id',
         'stage_id',
         'total',
-        'parent_id'
+        'parent_id',
+        'count',
+        'sql_count'
     }
 
+    MAX_RESERVE_COUNT = 1000
+
     def _get_values(self, **kwargs):
         for field in kwargs:
             if field not in self.ALLOWED_FIELDS:
@@ -42,6 +57,35 @@ class TaskLogController(http.Controller):
     def _get_registry(self):
         return Registry(request.httprequest.headers['X-Automation-DB'])
 
+    def _get_task_id(self, cr):
+        """ :return: task of the request token """
+        cr.execute("SELECT task_id FROM automation_task_token WHERE token = %s",
+                   (request.httprequest.headers['X-Automation-Token'], ))
+        row = cr.fetchone()
+        if not row:
+            raise Forbidden("Token not found")
+        return row[0]
+
+    def _check_task(self, cr, values_list):
+        """ Reject values of other tasks, than the task of the token """
+        task_id = self._get_task_id(cr)
+        stage_ids = set()
+        for values in values_list:
+            if values.get("task_id", task_id) != task_id:
+                raise Forbidden(f"Task {values['task_id']} not allowed!")
+            for field in ("stage_id", "parent_id"):
+                if values.get(field):
+                    stage_ids.add(values[field])
+
+        # stages are checked before they are created or
+        # changed, reserved stages are created with the checked task
+        if stage_ids:
+            cr.execute("SELECT id FROM automation_task_stage WHERE id IN %s AND task_id != %s LIMIT 1",
+                       (tuple(stage_ids), task_id))
+            row = cr.fetchone()
+            if row:
+                raise Forbidden(f"Stage {row[0]} not allowed!")
+
     @http.route(
         "/automation/log",
         type="http",
@@ -53,7 +97,10 @@ class TaskLogController(http.Controller):
         values = self._get_values(**kwargs)
         registry = self._get_registry()
         with registry.cursor() as cr:
+            self._check_task(cr, [values])
             env = Environment(cr, SUPERUSER_ID, {})
+            if isinstance(values.get("data"), str):
+                values["data"] = json.loads(values["data"])
 
             # check if progress passed
             # .. modify progress
@@ -79,6 +126,7 @@ class TaskLogController(http.Controller):
         values = self._get_values(**kwargs)
         registry = self._get_registry()
         with registry.cursor() as cr:
+            self._check_task(cr, [values])
             env = Environment(cr, SUPERUSER_ID, {})
             return str(env["automation.task.stage"].create(values).id)
 
@@ -94,8 +142,119 @@ class TaskLogController(http.Controller):
         values = self._get_values(**kwargs)
         registry = self._get_registry()
         with registry.cursor() as cr:
+            self._check_task(cr, [dict(values, stage_id=stage_id)])
             env = Environment(cr, SUPERUSER_ID, {})
             env["automation.task.stage"].browse(stage_id).write(
                 values
             )
-        return ""
\ No newline at end of file
+        return ""
+
+    @http.route(
+        "/automation/stage/reserve",
+        type="http",
+        auth="automation_task",
+        csrf=False,
+        methods=["POST"]
+    )
+    def stage_reserve(self, count=1, **kwargs):
+        """ Reserve stage ids, which are passed with the stage operations of a batch
+            :return: json array of ids
+        """
+        count = min(max(int(count), 1), self.MAX_RESERVE_COUNT)
+        registry = self._get_registry()
+        with registry.cursor() as cr:
+            cr.execute("SELECT nextval('automation_task_stage_id_seq') FROM generate_series(1, %s)", (count, ))
+            stage_ids = [r[0] for r in cr.fetchall()]
+        return request.make_json_response(stage_ids)
+
+    def _create_stage(self, env, values, stage_id=None):
+        """ Create stage, with the reserved id if passed """
+        if not stage_id:
+            return env["automation.task.stage"].create(values).id
+        env.cr.execute("""
+            INSERT INTO automation_task_stage(id, create_date, write_date, create_uid, write_uid, task_id, name, parent_id, progress, status, total, date_start)
+            VALUES (%s, NOW() at time zone 'UTC', NOW() at time zone 'UTC', %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (int(stage_id),
+              env.uid,
+              env.uid,
+              values["task_id"],
+              values["name"],
+              values.get("parent_id"),
+              values.get("progress", 0),
+              values.get("status", ""),
+              values.get("total"),
+              values.get("date_start")))
+        return int(stage_id)
+
+    @http.route(
+        "/automation/batch",
+        type="http",
+        auth="automation_task",
+        csrf=False,
+        methods=["POST"]
+    )
+    def batch(self, **kwargs):
+        """ Apply a json array of log, stage and progress operations
+            within one transaction, consecutive logs are created at once
+            :return: json array with the created ids, or null for progress
+        """
+        ops = []
+        for op in json.loads(request.httprequest.get_data()):
+            op_type = op.pop("op")
+            stage_id = op.pop("id", None) if op_type == "stage" else None
+            ops.append((op_type, stage_id, self._get_values(**op)))
+
+        results = []
+        registry = self._get_registry()
+        with registry.cursor() as cr:
+            self._check_task(cr, [values for _op_type, _stage_id, values in ops])
+            env = Environment(cr, SUPERUSER_ID, {})
+            log_obj = env["automation.task.log"]
+            stage_obj = env["automation.task.stage"]
+            logs = []
+
+            def create_logs():
+                if logs:
+                    results.extend(log_obj.create(logs).ids)
+                    logs.clear()
+
+            for op_type, stage_id, values in ops:
+                if op_type == "log":
+                    if isinstance(values.get("data"), str):
+                        values["data"] = json.loads(values["data"])
+                    logs.append(values)
+                    continue
+
+                create_logs()
+                if op_type == "stage":
+                    results.append(self._create_stage(env, values, stage_id))
+                elif op_type == "progress":
+                    stage_obj.browse(values.pop("stage_id")).write(values)
+                    results.append(None)
+                else:
+                    raise ValueError(f"Operation {op_type} not supported!")
+
+            create_logs()
+        return request.make_json_response(results)
+
+    @http.route(
+        "/automation/spill/<int:task_id>",
+        type="http",
+        auth="user",
+        methods=["GET"]
+    )
+    def spill(self, task_id, **kwargs):
+        """ Stream the decompressed log file of the task """
+        task = request.env["automation.task"].browse(task_id)
+        task.check_access("read")
+        attachment = task.sudo().spill_attachment_id
+        if not attachment:
+            raise request.not_found()
+        path = attachment._full_path(attachment.store_fname)
+
+        def generate():
+            with gzip.open(path, "rb") as spill:
+                while chunk := spill.read(65536):
+                    yield chunk
+
+        return Response(generate(), content_type="text/plain; charset=utf-8", direct_passthrough=True)
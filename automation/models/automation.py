@@ -1,11 +1,52 @@
+import os
+import time
 import uuid
+import socket
 import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
 import psycopg2
 from odoo import api, fields, models, exceptions, tools
-from .status import TaskStatus, AutomationTaskRequeueException
+from .status import (
+    TaskStatus,
+    TaskHeartbeat,
+    AutomationTaskRequeueException,
+    AutomationTaskCancelException,
+    AutomationTaskMemoryException,
+    HEARTBEAT_SQL,
+)
 
 _logger = logging.getLogger(__name__)
 
+DEFAULT_CRON_TIME_BUDGET_S = 60
+DEFAULT_RETRY_DELAY_S = 60
+DEFAULT_REQUEUE_DELAY_S = 10
+DEFAULT_HEARTBEAT_S = 60
+DEFAULT_WORKER_TIMEOUT_S = 600
+DEFAULT_MAX_MEMORY_REQUEUES = 3
+NOTIFY_CHANNEL = "automation_task"
+LOG_PARTITION_MONTHS_AHEAD = 2
+LOG_PARTITION_DAYS = 31
+# resource methods, which subtasks are allowed to call
+FANOUT_METHOD_PREFIX = "_run_chunk"
+# fields, which are only set by the fan out
+FANOUT_FIELDS = {"parent_id", "fanout"}
+
+# a task is blocked as long as a dependency is not done,
+# or the task it starts after is not finished
+TASK_BLOCKED_SQL = """(
+    EXISTS (
+        SELECT 1 FROM automation_task_dependency d
+        INNER JOIN automation_task dt ON dt.id = d.depends_id
+        WHERE d.task_id = t.id AND dt.state != 'done'
+    ) OR EXISTS (
+        SELECT 1 FROM automation_task st
+        WHERE st.id = t.start_after_task_id AND st.state IN ('draft', 'queued', 'wait', 'run')
+    )
+)"""
+
 
 def _list_all_models(self):
     """ show all available odoo models """
@@ -29,6 +70,7 @@ class AutomationTask(models.Model):
     state = fields.Selection([
         ("draft", "Draft"),
         ("queued", "Queued"),
+        ("wait", "Waiting"),
         ("run", "Running"),
         ("cancel", "Canceled"),
         ("failed", "Failed"),
@@ -56,16 +98,113 @@ class AutomationTask(models.Model):
     total_warnings = fields.Integer(compute="_compute_total_warnings")
     total_errors = fields.Integer(compute="_compute_total_errors")
 
+    wall_time = fields.Float("Wall Time (s)", compute="_compute_timing")
+    cpu_time = fields.Float("CPU Time (s)", compute="_compute_timing", help="CPU time of the task thread.")
+    sql_count = fields.Integer(
+        "SQL Statements",
+        compute="_compute_timing",
+        help="SQL statements of the server process, including other threads running concurrently.",
+    )
+
     task_id = fields.Many2one("automation.task", "Task", compute="_compute_task_id")
 
     error_count = fields.Integer(readonly=True)
     warning_count = fields.Integer(readonly=True)
 
+    priority = fields.Integer(default=10, help="Tasks with a lower priority value are started first.")
+    deadline = fields.Datetime(help="Tasks with the same priority are started by their deadline.")
+
+    channel = fields.Char(
+        required=True,
+        default="root",
+        index=True,
+        help="Queue the task is processed in, the number of parallel running tasks can be limited per queue.",
+    )
+
+    start_after_task_id = fields.Many2one(
+        "automation.task",
+        "Start After",
+        index=True,
+        readonly=True,
+        copy=False,
+        ondelete="set null",
+    )
+    depends_ids = fields.Many2many(
+        "automation.task",
+        "automation_task_dependency",
+        "task_id",
+        "depends_id",
+        string="Depends On",
+        copy=False,
+        help="The task starts after all of these tasks are done.",
+    )
+    dependent_ids = fields.Many2many(
+        "automation.task",
+        "automation_task_dependency",
+        "depends_id",
+        "task_id",
+        string="Dependent Tasks",
+        readonly=True,
+        copy=False,
+    )
+
+    eta = fields.Datetime(
+        "Start Not Before",
+        copy=False,
+        help="The task is not started before this time, e.g. to run heavy tasks at night.",
+    )
+    retry_count = fields.Integer("Retries", readonly=True, copy=False)
+    memory_requeue_count = fields.Integer(
+        "Memory Requeues",
+        readonly=True,
+        copy=False,
+        help="How often the task paused itself, because the memory limit was reached.",
+    )
+    spill_attachment_id = fields.Many2one("ir.attachment", "Log File", readonly=True, copy=False, ondelete="set null")
+    checkpoint = fields.Json(readonly=True, copy=False, help="State saved by the task to resume its work after a requeue.")
+    max_retries = fields.Integer(help="How often a failed task is queued again before it fails.")
+
+    worker = fields.Char(readonly=True, copy=False, help="Server process which runs the task.")
+    heartbeat = fields.Datetime("Last Seen", compute="_compute_heartbeat")
+
+    parent_id = fields.Many2one(
+        "automation.task",
+        "Parent Task",
+        index=True,
+        readonly=True,
+        copy=False,
+        ondelete="cascade",
+    )
+    child_ids = fields.One2many("automation.task", "parent_id", string="Subtasks", readonly=True)
+    parent_stage_id = fields.Many2one(
+        "automation.task.stage",
+        "Parent Stage",
+        readonly=True,
+        ondelete="set null",
+    )
+    fanout = fields.Json("Chunk", readonly=True, copy=False)
+
+    _queue_idx = models.Index("(priority, deadline, id) WHERE state = 'queued'")
 
     def _compute_task_id(self):
         for obj in self:
             self.task_id = obj
 
+    def _check_fanout_fields(self, vals_list):
+        """ Subtasks call the method of their chunk as superuser,
+            only the fan out is allowed to set it """
+        if not self.env.su and any(FANOUT_FIELDS & vals.keys() for vals in vals_list):
+            raise exceptions.AccessError(self.env._("Subtasks can only be created by the fan out of their task"))
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self._check_fanout_fields(vals_list)
+        return super().create(vals_list)
+
+    def write(self, vals):
+        self._check_fanout_fields([vals])
+        return super().write(vals)
+
     def _compute_progress(self):
         if not self.ids:
             self.progress = 0.0
@@ -114,12 +253,21 @@ class AutomationTask(models.Model):
         for obj in self:
             obj.res_ref = values.get(obj.id, None)
 
+    def _compute_heartbeat(self):
+        heartbeats = {}
+        if self.ids:
+            self.env["automation.task.signal"].flush_model()
+            self.env.cr.execute("SELECT task_id, heartbeat FROM automation_task_signal WHERE task_id IN %s", (tuple(self.ids), ))
+            heartbeats = dict(self.env.cr.fetchall())
+        for obj in self:
+            obj.heartbeat = heartbeats.get(obj.id)
+
     def _compute_total_logs(self):
         if not self.ids:
             self.total_logs = 0
             return
 
-        self.env.cr.execute("SELECT task_id, COUNT(*) FROM automation_task_log WHERE task_id IN %s GROUP BY 1",
+        self.env.cr.execute("SELECT task_id, SUM(count) FROM automation_task_log WHERE task_id IN %s GROUP BY 1",
                     (tuple(self.ids), ))
         values = dict(self.env.cr.fetchall())
         for obj in self:
@@ -131,7 +279,7 @@ class AutomationTask(models.Model):
             return
 
         self.env.cr.execute(
-            """SELECT task_id, COUNT(*) FROM automation_task_log
+            """SELECT task_id, SUM(count) FROM automation_task_log
             WHERE pri = 'w'
               AND task_id IN %s
             GROUP BY 1
@@ -146,7 +294,7 @@ class AutomationTask(models.Model):
             return
 
         self.env.cr.execute(
-            """SELECT task_id, COUNT(*) FROM automation_task_log
+            """SELECT task_id, SUM(count) FROM automation_task_log
             WHERE pri IN ('a','e','x')
               AND task_id IN %s GROUP BY 1
             """, (tuple(self.ids), ))
@@ -154,6 +302,27 @@ class AutomationTask(models.Model):
         for obj in self:
             obj.total_errors = values.get(obj.id) or 0
 
+    def _compute_timing(self):
+        if not self.ids:
+            self.wall_time = 0.0
+            self.cpu_time = 0.0
+            self.sql_count = 0
+            return
+
+        # the root stage measures the whole run
+        self.env["automation.task.stage"].flush_model(["wall_time", "cpu_time", "sql_count"])
+        self.env.cr.execute(
+            """SELECT task_id, wall_time, cpu_time, sql_count FROM automation_task_stage
+            WHERE task_id IN %s
+              AND parent_id IS NULL
+            """, (tuple(self.ids), ))
+        values = {r[0]: r[1:] for r in self.env.cr.fetchall()}
+        for obj in self:
+            wall_time, cpu_time, sql_count = values.get(obj.id) or (0.0, 0.0, 0)
+            obj.wall_time = wall_time or 0.0
+            obj.cpu_time = cpu_time or 0.0
+            obj.sql_count = sql_count or 0
+
     def _compute_total_stages(self):
         if not self.ids:
             self.total_stages = 0
@@ -229,8 +398,14 @@ class AutomationTask(models.Model):
         for task in self:
             # check rights
             task._check_execution_rights()
-            if task.state == "queued":
+            if task.state in ("queued", "wait"):
                 task.state = "cancel"
+                task._task_release()
+                # cancel pending subtasks
+                task.child_ids.filtered(lambda t: t.state in ("queued", "wait")).action_cancel()
+            elif task.state == "run":
+                # running task aborts itself
+                task._task_request_cancel()
 
         return True
 
@@ -274,6 +449,15 @@ class AutomationTask(models.Model):
             "context": {'display_exclude_root':True}
         }
 
+    def action_spill(self):
+        """ Show the log file of the task """
+        self.ensure_one()
+        return {
+            "type": "ir.actions.act_url",
+            "url": f"/automation/spill/{self.id}",
+            "target": "new",
+        }
+
     def action_refresh(self):
         return True
 
@@ -291,31 +475,214 @@ class AutomationTask(models.Model):
             return False
         return param.lower() in ('true', '1', 'yes', 'on')
 
-    def _task_enqueue(self):
-        """ queue task """
+    def _task_enqueue(self, values=None):
+        """ queue tasks, with a constant number of statements
+            independent of the number of tasks
+            :param dict values: additional values to write, e.g. eta
+        """
+        if not self:
+            return
 
         # remove stages
         self.env.cr.execute(
-            "DELETE FROM automation_task_stage WHERE task_id=%s",
-            (self.id, ),
+            "DELETE FROM automation_task_stage WHERE task_id IN %s",
+            (tuple(self.ids), ),
         )
 
-        # set queued and trigger cron
-        self.write({
-            "state": "queued"
-        })
+        # set queued, channels are
+        # written once per channel
+        self.write(dict(values or {}, state="queued"))
+        channels = defaultdict(list)
+        for task, options in self._task_batch_options():
+            channel = options.get("channel")
+            if channel and channel != task.channel:
+                channels[channel].append(task.id)
+        for channel, task_ids in channels.items():
+            self.browse(task_ids).write({"channel": channel})
+        self._task_wait()
+
+        # trigger cron once
         if self._is_run_unqueued():
-            self._process_task()
+            for task in self:
+                task._process_task()
         else:
-            self.env.ref('automation.ir_cron_automation_task')._trigger()
+            self._task_trigger()
+
+    @api.model
+    def _task_create_queued(self, vals_list):
+        """ Create and queue tasks in bulk
+            :return: queued tasks
+        """
+        tasks = self.create(vals_list)
+        tasks.sudo()._task_enqueue()
+        return tasks
+
+    def _task_wait(self):
+        """ Set queued tasks, which are blocked by other tasks, to wait """
+        self.flush_model(["state", "start_after_task_id", "depends_ids"])
+        self.env.cr.execute(
+            f"""UPDATE automation_task t SET state = 'wait'
+            WHERE t.id IN %s AND t.state = 'queued' AND {TASK_BLOCKED_SQL}
+            """, (tuple(self.ids), ))
+        self.invalidate_recordset(["state"])
+
+    def _task_release(self):
+        """ Queue waiting tasks, which are not blocked anymore
+            after this task finished, only direct successors are checked
+            :return: released tasks
+        """
+        if not self.ids:
+            return self.browse()
+
+        self.flush_model(["state", "start_after_task_id", "depends_ids"])
+        self.env.cr.execute(
+            f"""UPDATE automation_task t SET state = 'queued'
+            WHERE t.state = 'wait'
+              AND (t.start_after_task_id IN %s
+                   OR t.id IN (SELECT task_id FROM automation_task_dependency WHERE depends_id IN %s))
+              AND NOT {TASK_BLOCKED_SQL}
+            RETURNING t.id
+            """, (tuple(self.ids), tuple(self.ids)))
+        released = self.browse([r[0] for r in self.env.cr.fetchall()])
+        if released:
+            released.invalidate_recordset(["state"])
+            released._task_trigger()
+
+        # dependents of failed or canceled tasks can not start anymore
+        self.filtered(lambda t: t.state in ("failed", "cancel"))._task_cancel_dependents()
+
+        # finish parents waiting for their subtasks
+        self.parent_id.filtered(lambda t: t.state == "wait")._task_finish_subtasks()
+        return released
+
+    def _task_cancel_dependents(self):
+        """ Cancel tasks, which depend on these failed or canceled tasks,
+            they would wait forever otherwise
+            :return: canceled tasks
+        """
+        if not self.ids:
+            return self.browse()
+
+        self.flush_model(["state", "depends_ids"])
+        self.env.cr.execute(
+            """SELECT DISTINCT t.id FROM automation_task t
+            INNER JOIN automation_task_dependency d ON d.task_id = t.id
+            WHERE d.depends_id IN %s
+              AND t.state IN ('queued', 'wait')
+            """, (tuple(self.ids), ))
+        dependents = self.browse([r[0] for r in self.env.cr.fetchall()])
+        for dependent in dependents:
+            dependencies = dependent.depends_ids & self
+            error = self.env._("Dependency %s did not finish", ", ".join(dependencies.mapped("name")))
+            _logger.warning("Task %s: %s", dependent.id, error)
+            dependent.write({
+                "state_change": fields.Datetime.now(),
+                "state": "cancel",
+                "error": error,
+            })
+
+        # cancel their dependents too
+        dependents._task_release()
+        return dependents
+
+    def _task_fan_out(self, method, chunks, model=None, stage_id=None):
+        """ Create a queued subtask per chunk
+            :param str method: resource method, called with taskc and chunk
+            :param list chunks: list of id lists
+            :param str model: model of the ids, chunks are passed as recordset
+            :param int stage_id: stage which shows the progress of the subtasks
+            :return: subtasks
+        """
+        self.ensure_one()
+        self._task_check_fanout_method(method)
+        tasks = self.sudo().create([{
+            "name": f"{self.name} ({i}/{len(chunks)})",
+            "parent_id": self.id,
+            "parent_stage_id": stage_id,
+            "owner_id": self.owner_id.id,
+            "group_id": self.group_id.id,
+            "res_model": self.res_model,
+            "res_id": self.res_id,
+            "channel": self.channel,
+            "priority": self.priority,
+            "max_retries": self.max_retries,
+            "fanout": {"method": method, "model": model, "ids": chunk},
+        } for i, chunk in enumerate(chunks, 1)])
+        tasks._task_enqueue()
+        return tasks.with_env(self.env)
+
+    @api.model
+    def _task_check_fanout_method(self, method):
+        """ Only resource methods declared for chunk runs can be called by subtasks """
+        if not isinstance(method, str) or not method.startswith(FANOUT_METHOD_PREFIX):
+            raise exceptions.UserError(self.env._(
+                "Method %(method)s can not run chunks, it has to start with %(prefix)s",
+                method=method, prefix=FANOUT_METHOD_PREFIX))
+
+    def _task_finish_subtasks(self):
+        """ Finish waiting parent tasks, if all of their subtasks finished
+            :return: finished tasks
+        """
+        finished = self.browse()
+        for task in self:
+            subtasks = task.child_ids
+            if not subtasks or subtasks.filtered(lambda t: t.state in ("draft", "queued", "wait", "run")):
+                continue
+
+            failed = subtasks.filtered(lambda t: t.state != "done")
+            values = {
+                "state_change": fields.Datetime.now(),
+                "state": "failed" if failed else "done",
+                "error": self.env._("%(failed)s of %(total)s subtasks failed",
+                                    failed=len(failed), total=len(subtasks)) if failed else None,
+                "error_count": task.error_count + sum(subtasks.mapped("error_count")),
+                "warning_count": task.warning_count + sum(subtasks.mapped("warning_count")),
+            }
+            # subtasks finishing at the same time could compete
+            # for the parent, the recovery of the queue does the rest
+            try:
+                with self.env.cr.savepoint():
+                    task.write(values)
+                    task._task_release()
+                finished |= task
+            except psycopg2.OperationalError:
+                _logger.info("Task %s is finished by another worker", task.id)
+        return finished
+
+    def _task_run(self, resource, taskc):
+        """ Run the task, or the chunk of its parent task """
+        fanout = self.fanout
+        if fanout:
+            chunk = fanout["ids"]
+            if fanout.get("model"):
+                chunk = self.env[fanout["model"]].browse(chunk)
+            self._task_check_fanout_method(fanout["method"])
+            getattr(resource, fanout["method"])(taskc, chunk)
+        else:
+            resource._run(taskc)
+
+    def _task_trigger(self):
+        """ Trigger the cron when the first of the tasks is due,
+            and wake up automation workers """
+        etas = self.mapped("eta")
+        at = min(etas) if all(etas) else None
+        self.env.ref('automation.ir_cron_automation_task')._trigger(at=at)
+        self[0]._task_notify()
+
+    def _task_notify(self):
+        """ Wake up automation workers listening on the queue,
+            the notification is delivered on commit """
+        self.env.cr.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, str(self.id)))
 
     def action_queue(self):
         for task in self:
             # check rights
             task._check_execution_rights()
-            if task.state in ("draft", "cancel", "failed", "done"):
-                # sudo task, and check if it is not active already
-                task.sudo()._task_enqueue()
+
+        # sudo tasks, and check if they are not active already
+        tasks = self.filtered(lambda t: t.state in ("draft", "cancel", "failed", "done")).sudo()
+        tasks.child_ids.unlink()
+        tasks._task_enqueue({"retry_count": 0, "memory_requeue_count": 0, "checkpoint": None})
         return True
 
     def action_restart(self):
@@ -334,12 +701,35 @@ class AutomationTask(models.Model):
         options = {"stages": 1, "resource": resource}
 
         # fetch custom options
+        options.update(self._task_resource_options(resource))
+        return options
+
+    def _task_batch_options(self):
+        """ Custom options of the tasks, the resources are browsed
+            per model, to read their fields in batch
+            :return: list of (task, options)
+        """
+        res = []
+        model_tasks = defaultdict(list)
+        for task in self:
+            model_tasks[task.res_model if task.res_model and task.res_id else None].append(task)
+        for res_model, tasks in model_tasks.items():
+            if res_model:
+                resources = self.env[res_model].browse([task.res_id for task in tasks])
+            else:
+                resources = self.browse([task.id for task in tasks])
+            res.extend((task, self._task_resource_options(resource)) for task, resource in zip(tasks, resources))
+        return res
+
+    @api.model
+    def _task_resource_options(self, resource):
+        """ :return: custom options of the resource """
         if hasattr(resource, "_run_options"):
             res_options = getattr(resource, "_run_options")
             if callable(res_options):
                 res_options = resource._run_options()
-            options.update(res_options)
-        return options
+            return dict(res_options)
+        return {}
 
     def _commit_state(self):
         """ ugly hack but needed to commit changes """
@@ -359,13 +749,59 @@ class AutomationTask(models.Model):
             if self.state == 'queued':
                 self._process_task()
 
+    def _task_status(self, stage_count, options):
+        """ :return: status of the task run, logs are written by a second
+            cursor, within the task transaction (option local),
+            or over http (option token)
+        """
+        self.ensure_one()
+        token = None
+        if options.get("token"):
+            token = self.env["automation.task.token"].sudo().create({"task_id": self.id}).token
+            self._commit_state()
+        return TaskStatus(self, stage_count, local=options.get("local", False), token=token, options=options)
+
+    def _task_revoke_token(self):
+        self.env.cr.execute("DELETE FROM automation_task_token WHERE task_id IN %s", (tuple(self.ids), ))
+
+    def _task_request_cancel(self):
+        """ Request the running task to cancel, the flag is written as signal,
+            because the task transaction would not see a change of the task """
+        self.env.cr.execute(
+            """INSERT INTO automation_task_signal (task_id, cancel_requested)
+            VALUES (%s, TRUE)
+            ON CONFLICT (task_id) DO UPDATE SET cancel_requested = TRUE
+            """, (self.id, ))
+        self.env["automation.task.signal"].invalidate_model(["cancel_requested"])
+
+    def _task_beat(self):
+        """ Write the heartbeat of the running task """
+        self.env.cr.execute(HEARTBEAT_SQL, (self.id, ))
+        self.invalidate_recordset(["heartbeat"])
+
+    def _task_get_delay(self, options, name, default):
+        """ :return: delay in seconds from the task options,
+            or from the system parameter automation.<name> """
+        delay = options.get(name)
+        if delay is None:
+            param = self.env['ir.config_parameter'].sudo().get_param(f'automation.{name}')
+            delay = int(param) if param else default
+        return delay
+
     def _process_task(self):
+        """ Run the queued task
+            :return: False if the memory limit of the process was reached,
+                and no further tasks should be processed by it
+        """
         self.ensure_one()
         task = self
+        taskc = None
+        proceed = True
 
         if task and task.state == "queued":
             error_count = 0
             warning_count = 0
+            task_options = {}
             try:
                 task_options = task._task_options()
                 stage_count = task_options["stages"]
@@ -373,18 +809,21 @@ class AutomationTask(models.Model):
 
                 # check if it is a singleton task
                 # if already another task run, requeue
-                # don't process this task
-                if task_options.get("singleton"):
+                # don't process this task, subtasks are
+                # part of their parent and not checked
+                if task_options.get("singleton") and not task.parent_id:
                     # check concurrent
                     self.env.cr.execute(
-                        "SELECT MIN(id) FROM automation_task WHERE res_model=%s AND state IN ('queued','run')",
-                        (resource._model._name, ),
+                        "SELECT MIN(id) FROM automation_task WHERE res_model=%s AND state IN ('queued','wait','run')",
+                        (resource._name, ),
                     )
 
                     active_task_id = self.env.cr.fetchone()[0]
                     if active_task_id and active_task_id < task.id:
-                        # queue task after running
+                        # wait until the active task finished
                         task.write({"start_after_task_id": active_task_id})
+                        task._task_wait()
+                        self._commit_state()
                         return True
 
                 # change task state
@@ -395,14 +834,18 @@ class AutomationTask(models.Model):
                     "error": None,
                     "error_count": 0,
                     "warning_count": 0,
+                    "worker": f"{socket.gethostname()}:{os.getpid()}/{threading.current_thread().name}",
                 })
+                self.env.cr.execute("DELETE FROM automation_task_signal WHERE task_id = %s", (task.id, ))
+                task._task_beat()
                 # commit after start
                 self._commit_state()
 
                 # run task
-                with TaskStatus(task, stage_count, options=task_options) as taskc:
+                with TaskHeartbeat(task, DEFAULT_HEARTBEAT_S), \
+                        task._task_status(stage_count, task_options) as taskc:
                     try:
-                        resource._run(taskc)
+                        task._task_run(resource, taskc)
                     finally:
                         error_count = taskc.errors
                         warning_count = taskc.warnings
@@ -412,13 +855,21 @@ class AutomationTask(models.Model):
                         if error_count:
                             raise exceptions.UserError(self.env._("Task finished with errors"))
 
-                # update status and commit
+                # update status and commit, wait
+                # if the task was split into subtasks
+                subtasks = task.child_ids.filtered(lambda t: t.state in ("queued", "wait", "run"))
                 task.write({"state_change": fields.Datetime.now(),
-                            "state": "done",
+                            "state": "wait" if subtasks else "done",
                             "error": None,
+                            "checkpoint": None,
                             "error_count": error_count,
                             "warning_count": warning_count
                     })
+                if not subtasks:
+                    task._task_release()
+                task._task_revoke_token()
+                # the channel slot is free again
+                task._task_notify()
 
                 # pylint: disable=invalid-commit
                 self._commit_state()
@@ -426,8 +877,44 @@ class AutomationTask(models.Model):
             # pylint: disable=broad-exception-caught
             except Exception as e:
                 if isinstance(e, AutomationTaskRequeueException):
-                    # check if task should be requeued later
-                    self.with_context(task_unqueued_run=False)._task_enqueue()
+                    values = {}
+                    if isinstance(e, AutomationTaskMemoryException):
+                        # the memory is not given back
+                        # to the os by the process
+                        proceed = False
+                        values["memory_requeue_count"] = task.memory_requeue_count + 1
+                    max_memory_requeues = self._task_get_delay(task_options, "max_memory_requeues", DEFAULT_MAX_MEMORY_REQUEUES)
+                    if values.get("memory_requeue_count", 0) > max_memory_requeues:
+                        # the memory is used by the process, not only
+                        # by the task, do not requeue it endlessly
+                        task.write({
+                            "state_change": fields.Datetime.now(),
+                            "state": "failed",
+                            "error": self.env._("Memory limit reached %s times", values["memory_requeue_count"]),
+                            "memory_requeue_count": values["memory_requeue_count"],
+                            "error_count": error_count,
+                            "warning_count": warning_count
+                        })
+                        task._task_release()
+                    else:
+                        # requeue task, delayed to avoid
+                        # that it is picked up again immediately
+                        delay = self._task_get_delay(task_options, "requeue_delay_s", DEFAULT_REQUEUE_DELAY_S)
+                        if delay:
+                            values["eta"] = fields.Datetime.now() + timedelta(seconds=delay)
+                        self.with_context(task_unqueued_run=False)._task_enqueue(values)
+                elif isinstance(e, AutomationTaskCancelException):
+                    # discard the work done
+                    self._rollback_state()
+                    task = self.browse(task.id)
+                    task.write({
+                        "state_change": fields.Datetime.now(),
+                        "state": "cancel",
+                        "error_count": error_count,
+                        "warning_count": warning_count
+                    })
+                    task._task_release()
+                    task.child_ids.filtered(lambda t: t.state in ("queued", "wait")).action_cancel()
                 else:
                     # rollback on error
                     self._rollback_state()
@@ -449,41 +936,345 @@ class AutomationTask(models.Model):
                     if not error:
                         error = "Unexpected error, see logs"
 
-                    # write error
-                    task.write({
-                        "state_change": fields.Datetime.now(),
-                        "state": "failed",
-                        "error": error,
-                        "error_count": error_count,
-                        "warning_count": warning_count
-                    })
+                    if task.retry_count < task.max_retries:
+                        # retry with exponential backoff
+                        delay = self._task_get_delay(task_options, "retry_delay_s", DEFAULT_RETRY_DELAY_S)
+                        delay *= 2 ** task.retry_count
+                        task.with_context(task_unqueued_run=False)._task_enqueue({
+                            "eta": fields.Datetime.now() + timedelta(seconds=delay),
+                            "retry_count": task.retry_count + 1,
+                            "error": error,
+                            "error_count": error_count,
+                            "warning_count": warning_count
+                        })
+                    else:
+                        # write error
+                        task.write({
+                            "state_change": fields.Datetime.now(),
+                            "state": "failed",
+                            "error": error,
+                            "error_count": error_count,
+                            "warning_count": warning_count
+                        })
+                        task._task_release()
+
+                # the log file of the failure is kept
+                if taskc is not None:
+                    try:
+                        with self.env.cr.savepoint():
+                            taskc.attach_spill(task)
+                    # pylint: disable=broad-exception-caught
+                    except Exception:
+                        _logger.exception("Attaching the log file of task %s failed", task.id)
+                task._task_revoke_token()
+                task._task_notify()
 
                 # finally commit current state after
                 # rollback or requeue
                 self._commit_state()
 
-        return True
+        return proceed
+
+
+    @api.model
+    def _get_channel_capacity(self):
+        """ :return: dict of channel and max. parallel running tasks,
+            configured like root:4,root.import:2,root.mail:1 """
+        capacity = {}
+        param = self.env['ir.config_parameter'].sudo().get_param('automation.channels')
+        for item in (param or "").split(","):
+            name, _sep, limit = item.strip().partition(":")
+            if name and limit.strip().isdigit():
+                capacity[name] = int(limit)
+        return capacity
+
+    @api.model
+    def _get_channel_limit(self, channel, capacity):
+        """ :return: configured channel and its limit, sub channels
+            without own configuration share the limit of the parent channel """
+        name = channel
+        while name:
+            if name in capacity:
+                return name, capacity[name]
+            name = name.rpartition(".")[0]
+        return None, 0
+
+    @api.model
+    def _get_channel_exclude(self, limit_channel, capacity):
+        """ :return: sql condition and params, matching the channels
+            which share the limit of the passed channel """
+        query = "(channel = %s OR starts_with(channel, %s))"
+        params = [limit_channel, f"{limit_channel}."]
+        for name in capacity:
+            # sub channels with own configuration have their own limit
+            if name.startswith(f"{limit_channel}."):
+                query += " AND NOT (channel = %s OR starts_with(channel, %s))"
+                params.extend([name, f"{name}."])
+        return f"({query})", params
 
+    @api.model
+    def _channel_acquire(self, channel, limit):
+        """ Acquire a free slot of the channel,
+            slots are session advisory locks, so they are released
+            automatically if the worker connection dies
+            :return: lock key or None if the channel is full
+        """
+        for slot in range(limit):
+            self.env.cr.execute("SELECT pg_try_advisory_lock(hashtext(%s), %s)", (f"automation.channel.{channel}", slot))
+            if self.env.cr.fetchone()[0]:
+                return (channel, slot)
+        return None
+
+    @api.model
+    def _channel_release(self, lock):
+        channel, slot = lock
+        self.env.cr.execute("SELECT pg_advisory_unlock(hashtext(%s), %s)", (f"automation.channel.{channel}", slot))
+
+    def _task_dequeue(self, exclude_ids=None):
+        """ Claim the next queued task, tasks locked by
+            other workers are skipped instead of waited for
+            :return: task and channel lock, which has to be released after processing
+        """
+        self.flush_model(["state", "channel"])
+        capacity = self._get_channel_capacity()
+        full_channels = set()
+        while True:
+            query = "SELECT id, channel FROM automation_task WHERE state = 'queued'"
+            params = []
+            if exclude_ids:
+                query += " AND id NOT IN %s"
+                params.append(tuple(exclude_ids))
+            for limit_channel in full_channels:
+                exclude_query, exclude_params = self._get_channel_exclude(limit_channel, capacity)
+                query += f" AND NOT {exclude_query}"
+                params.extend(exclude_params)
+            query += " AND (eta IS NULL OR eta <= (NOW() AT TIME ZONE 'UTC'))"
+            query += " ORDER BY priority, deadline, id FOR UPDATE SKIP LOCKED LIMIT 1"
+            self.env.cr.execute(query, params)
+            row = self.env.cr.fetchone()
+            if not row:
+                return self.browse(), None
+
+            task_id, channel = row
+            limit_channel, limit = self._get_channel_limit(channel, capacity)
+            if not limit_channel:
+                return self.browse(task_id), None
+
+            lock = self._channel_acquire(limit_channel, limit)
+            if lock:
+                return self.browse(task_id), lock
+
+            # skip all tasks limited by the full channel
+            full_channels.add(limit_channel)
+
+    @api.model
+    def _task_recover(self):
+        """ Recover running tasks, which lost their worker (e.g. killed
+            or redeployed), the task is retried if its budget allows it,
+            or canceled if a cancel was requested
+            :return: recovered tasks
+        """
+        timeout_s = self._task_get_delay({}, "worker_timeout_s", DEFAULT_WORKER_TIMEOUT_S)
+        self.flush_model(["state", "state_change"])
+        self.env["automation.task.signal"].flush_model()
+        self.env.cr.execute(
+            """SELECT t.id, COALESCE(s.cancel_requested, FALSE) FROM automation_task t
+            LEFT JOIN automation_task_signal s ON s.task_id = t.id
+            WHERE t.state = 'run'
+              AND COALESCE(s.heartbeat, t.state_change) < (NOW() AT TIME ZONE 'UTC') - make_interval(secs => %s)
+            FOR UPDATE OF t SKIP LOCKED
+            """, (timeout_s, ))
+        cancel_requested = dict(self.env.cr.fetchall())
+        tasks = self.browse(list(cancel_requested))
+        for task in tasks:
+            error = self.env._("Worker %(worker)s lost, no heartbeat since %(heartbeat)s",
+                               worker=task.worker, heartbeat=task.heartbeat or task.state_change)
+            _logger.warning("Task %s: %s", task.id, error)
+            if cancel_requested[task.id]:
+                task.write({
+                    "state_change": fields.Datetime.now(),
+                    "state": "cancel",
+                    "error": error,
+                })
+                task._task_release()
+                task.child_ids.filtered(lambda t: t.state in ("queued", "wait")).action_cancel()
+            elif task.retry_count < task.max_retries:
+                task.with_context(task_unqueued_run=False)._task_enqueue({
+                    "retry_count": task.retry_count + 1,
+                    "error": error,
+                })
+            else:
+                task.write({
+                    "state_change": fields.Datetime.now(),
+                    "state": "failed",
+                    "error": error,
+                })
+                task._task_release()
+
+        # finish parents, whose last subtasks finished concurrently
+        self.flush_model(["state", "parent_id"])
+        self.env.cr.execute(
+            """SELECT p.id FROM automation_task p
+            WHERE p.state = 'wait'
+              AND EXISTS (SELECT 1 FROM automation_task c WHERE c.parent_id = p.id)
+              AND NOT EXISTS (
+                SELECT 1 FROM automation_task c
+                WHERE c.parent_id = p.id AND c.state IN ('draft', 'queued', 'wait', 'run')
+              )
+            """)
+        parents = self.browse([r[0] for r in self.env.cr.fetchall()])._task_finish_subtasks()
+
+        # queue waiting tasks, which were set to wait concurrently
+        # to the finish of the task they waited for, and were not released
+        self.flush_model(["state", "parent_id", "start_after_task_id", "depends_ids"])
+        self.env.cr.execute(
+            f"""UPDATE automation_task SET state = 'queued'
+            WHERE id IN (
+                SELECT t.id FROM automation_task t
+                WHERE t.state = 'wait'
+                  AND NOT EXISTS (SELECT 1 FROM automation_task c WHERE c.parent_id = t.id)
+                  AND NOT {TASK_BLOCKED_SQL}
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id
+            """)
+        released = self.browse([r[0] for r in self.env.cr.fetchall()])
+        if released:
+            released.invalidate_recordset(["state"])
+            released._task_trigger()
+
+        # cancel waiting tasks, whose dependencies failed or were canceled
+        self.env.cr.execute(
+            """SELECT DISTINCT dt.id FROM automation_task_dependency d
+            INNER JOIN automation_task t ON t.id = d.task_id
+            INNER JOIN automation_task dt ON dt.id = d.depends_id
+            WHERE t.state = 'wait'
+              AND dt.state IN ('failed', 'cancel')
+            """)
+        canceled = self.browse([r[0] for r in self.env.cr.fetchall()])._task_cancel_dependents()
+
+        if tasks or parents or released or canceled:
+            self._commit_state()
+        return tasks
+
+    @api.model
+    def _process_queue(self, time_budget_s=0):
+        """ Process queued tasks until the queue is empty, the time
+            budget (0 = unlimited) is exhausted, or the memory limit is reached
+            :return: number of processed tasks
+        """
+        self._task_recover()
+
+        start_time = time.time()
+        processed_ids = set()
+        while True:
+            # tasks which are still queued after processing
+            # (e.g. singleton tasks) are not claimed twice
+            task, lock = self._task_dequeue(exclude_ids=processed_ids)
+            if not task:
+                break
+
+            processed_ids.add(task.id)
+            try:
+                proceed = task._process_task()
+            finally:
+                if lock:
+                    self._channel_release(lock)
+
+            # drop cache of the processed task
+            self.env.invalidate_all()
+            # stop, the process has to be restarted
+            # to free its memory
+            if not proceed:
+                break
+            if time_budget_s and time.time() - start_time > time_budget_s:
+                break
+
+        return len(processed_ids)
+
+    @api.model
+    def _task_next_due_s(self):
+        """ :return: seconds until the next delayed task is due, or None """
+        self.flush_model(["state", "eta"])
+        self.env.cr.execute(
+            """SELECT EXTRACT(EPOCH FROM MIN(eta) - (NOW() AT TIME ZONE 'UTC'))
+            FROM automation_task
+            WHERE state = 'queued'
+              AND eta > (NOW() AT TIME ZONE 'UTC')
+            """)
+        due_s = self.env.cr.fetchone()[0]
+        return float(due_s) if due_s is not None else None
 
     @api.model
     def _cron_run(self):
-        # get available tasks
-        ids = None
-        try:
-            self.env.cr.execute("""SELECT id FROM automation_task WHERE state = 'queued' FOR UPDATE NOWAIT LIMIT 1""")
-            ids = [r[0] for r in self.env.cr.fetchall()]
-        except psycopg2.OperationalError:
-            # return if there is a concurrency error
-            self.env.cr.rollback()
-            return
+        param = self.env['ir.config_parameter'].sudo().get_param('automation.cron_time_budget_s')
+        time_budget_s = int(param) if param else DEFAULT_CRON_TIME_BUDGET_S
+        self._process_queue(time_budget_s=time_budget_s)
 
-        # return if no tasks available
-        if not ids:
-            return
+    @api.model
+    def _task_cleanup(self, state, retention_days):
+        """ Delete tasks of the passed state, which finished
+            before the retention days, subtasks are deleted with their parent
+            :return: number of deleted tasks
+        """
+        self.flush_model(["state", "state_change", "spill_attachment_id"])
+        self.env.cr.execute(
+            """SELECT id FROM automation_task
+            WHERE state = %s
+              AND parent_id IS NULL
+              AND state_change < (NOW() AT TIME ZONE 'UTC') - make_interval(days => %s)
+            """, (state, retention_days))
+        task_ids = tuple(r[0] for r in self.env.cr.fetchall())
+        if not task_ids:
+            return 0
+
+        # log files of the tasks and their subtasks
+        # are not deleted by the cascade
+        self.env.cr.execute(
+            """WITH RECURSIVE tree AS (
+                SELECT id, spill_attachment_id FROM automation_task WHERE id IN %s
+                UNION ALL
+                SELECT t.id, t.spill_attachment_id FROM automation_task t
+                INNER JOIN tree ON t.parent_id = tree.id
+            )
+            SELECT spill_attachment_id FROM tree WHERE spill_attachment_id IS NOT NULL
+            """, (task_ids, ))
+        self.env["ir.attachment"].sudo().browse([r[0] for r in self.env.cr.fetchall()]).unlink()
 
-        # process task
-        self.env["automation.task"].browse(ids[0])._process_task()
+        self.env.cr.execute("DELETE FROM automation_task WHERE id IN %s", (task_ids, ))
+        deleted = self.env.cr.rowcount
+        if deleted:
+            _logger.info("%s %s tasks deleted", deleted, state)
+            self.invalidate_model()
+        return deleted
 
+    @api.model
+    def _cron_cleanup(self):
+        """ Partition logs if enabled, and remove
+            logs and tasks after their retention time """
+        param_obj = self.env['ir.config_parameter'].sudo()
+        log_obj = self.env['automation.task.log']
+        if param_obj.get_param('automation.log_partitioned'):
+            log_obj._log_partition_enable()
+            log_obj._log_partition_ensure()
+            self._commit_state()
+
+        # drop logs first, so that less logs
+        # have to be deleted with their tasks
+        log_retention_days = int(param_obj.get_param('automation.log_retention_days') or 0)
+        if log_retention_days:
+            log_obj._log_cleanup(log_retention_days)
+            self._commit_state()
+
+        for state in ("done", "failed"):
+            retention_days = int(param_obj.get_param(f'automation.retention_{state}_days') or 0)
+            if retention_days:
+                # with partitioned logs, tasks are kept until the partitions
+                # of their logs are dropped, their logs would be deleted row by row
+                if log_retention_days and log_obj._log_is_partitioned():
+                    retention_days = max(retention_days, log_retention_days + LOG_PARTITION_DAYS)
+                self._task_cleanup(state, retention_days)
+                self._commit_state()
 
 
 class AutomationTaskMixin(models.AbstractModel):
@@ -496,11 +1287,26 @@ class AutomationTaskMixin(models.AbstractModel):
     @api.model_create_multi
     def create(self, vals_list):
         tasks = super(AutomationTaskMixin, self).create(vals_list)
-        for task in tasks:
-            task.res_model = self._name
-            task.res_id = task.id
+        if tasks:
+            # link all tasks with one statement
+            self.env.cr.execute(
+                f"""UPDATE automation_task t SET res_model = %s, res_id = r.id
+                FROM {self._table} r
+                WHERE r.task_id = t.id AND r.id IN %s
+                """, (self._name, tuple(tasks.ids)))
+            tasks.task_id.invalidate_recordset(["res_model", "res_id"])
+            tasks.invalidate_recordset(["res_model", "res_id"])
         return tasks
 
+    @api.model
+    def _task_create_queued(self, vals_list):
+        """ Create and queue tasks in bulk
+            :return: queued records
+        """
+        records = self.create(vals_list)
+        records.task_id.sudo()._task_enqueue()
+        return records
+
     def unlink(self):
         # search inherited
         ids = self.ids
@@ -545,6 +1351,9 @@ class AutomationTaskMixin(models.AbstractModel):
     def action_error(self):
         return self.task_id.action_error()
 
+    def action_spill(self):
+        return self.task_id.action_spill()
+
     def _test_task(self):
         return self.task_id._test_task()
 
@@ -577,7 +1386,18 @@ class AutomationTaskStage(models.Model):
     parent_id = fields.Many2one("automation.task.stage", "Parent Stage", readonly=True, index=True)
     total = fields.Integer(readonly=True)
 
+    date_start = fields.Datetime("Started", readonly=True)
+    date_end = fields.Datetime("Finished", readonly=True)
+    wall_time = fields.Float("Wall Time (s)", readonly=True)
+    cpu_time = fields.Float("CPU Time (s)", readonly=True, help="CPU time of the task thread.")
+    sql_count = fields.Integer(
+        "SQL Statements",
+        readonly=True,
+        help="SQL statements of the server process, including other threads running concurrently.",
+    )
+
     child_ids = fields.One2many("automation.task.stage", "parent_id", string="Substages", copy=False)
+    subtask_ids = fields.One2many("automation.task", "parent_stage_id", string="Subtasks", readonly=True)
 
     def _compute_name(self):
         exclude_root = self.env.context.get('display_exclude_root')
@@ -600,6 +1420,13 @@ class AutomationTaskStage(models.Model):
         if progress > 0:
             return min(progress, 100.0)
 
+        # progress of the subtasks
+        subtasks = self.subtask_ids
+        if subtasks:
+            for subtask in subtasks:
+                progress += 100.0 if subtask.state in ("done", "failed", "cancel") else subtask.progress
+            return min(round(progress / len(subtasks)), 100.0)
+
         # otherwise return the overall progress
         # for the childs
         childs = self.child_ids
@@ -658,6 +1485,7 @@ class AutomationTaskLog(models.Model):
     safe_ref = fields.Reference(_list_all_models, string="Reference", compute="_compute_safe_ref", store=False, readonly=True)
     code = fields.Char(index=True, readonly=True)
     data = fields.Json(readonly=True)
+    count = fields.Integer(default=1, readonly=True, help="Number of messages collapsed into this log.")
 
     def _compute_safe_ref(self):
         ids = self.ids
@@ -674,6 +1502,167 @@ class AutomationTaskLog(models.Model):
                         ref_obj = None
                 objs[obj_id]['safe_ref'] = ref_obj
 
+    @api.model
+    def _log_is_partitioned(self):
+        self.env.cr.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (self._table, ))
+        row = self.env.cr.fetchone()
+        return bool(row and row[0] == 'p')
+
+    @api.model
+    def _log_partition_name(self, month):
+        return f"{self._table}_p{month:%Y%m}"
+
+    def _auto_init(self):
+        res = super()._auto_init()
+        # odoo does not manage the schema of partitioned tables, columns of
+        # new fields are added here, new indexes have to be created manually
+        if self._log_is_partitioned():
+            columns = tools.table_columns(self.env.cr, self._table)
+            for field in self._fields.values():
+                if field.store and field.column_type and field.name not in columns:
+                    tools.create_column(self.env.cr, self._table, field.name, field.column_type[1], field.string)
+                    self._init_column(field.name)
+        return res
+
+    @api.model
+    def _log_partition_create(self, month):
+        """ Create the partition of the passed month (first day), if not exist.
+            Logs of the month in the default partition are moved into it """
+        name = self._log_partition_name(month)
+        cr = self.env.cr
+        cr.execute("SELECT to_regclass(%s)", (name, ))
+        if cr.fetchone()[0]:
+            return
+
+        table = self._table
+        next_month = month + relativedelta(months=1)
+        cr.execute(f'CREATE TABLE "{name}" (LIKE "{table}" INCLUDING DEFAULTS)')
+        cr.execute("SELECT to_regclass(%s)", (f"{table}_default", ))
+        if cr.fetchone()[0]:
+            columns = ", ".join(f'"{column}"' for column in tools.table_columns(cr, table))
+            cr.execute(f"""WITH moved AS (
+                    DELETE FROM "{table}_default"
+                    WHERE create_date >= %s AND create_date < %s
+                    RETURNING {columns}
+                )
+                INSERT INTO "{name}" ({columns}) SELECT {columns} FROM moved
+            """, (month, next_month))
+        cr.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s)', (month, next_month))
+
+    @api.model
+    def _log_partition_ensure(self, months=LOG_PARTITION_MONTHS_AHEAD):
+        """ Create partitions for the current and the next months """
+        month = fields.Date.today().replace(day=1)
+        for i in range(months + 1):
+            self._log_partition_create(month + relativedelta(months=i))
+
+    @api.model
+    def _log_partition_list(self):
+        """ :return: list of (partition name, month) """
+        self.env.cr.execute(
+            """SELECT c.relname FROM pg_inherits i
+            INNER JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            ORDER BY c.relname
+            """, (self._table, ))
+        prefix = f"{self._table}_p"
+        partitions = []
+        for (name, ) in self.env.cr.fetchall():
+            if name.startswith(prefix):
+                month = datetime.strptime(name[len(prefix):], "%Y%m").date()
+                partitions.append((name, month))
+        return partitions
+
+    @api.model
+    def _log_partition_enable(self):
+        """ Convert the log table into a table partitioned by month of creation,
+            the id sequence, the indexes and the foreign keys are kept.
+            The table is locked during the conversion, all logs are copied.
+        """
+        if self._log_is_partitioned():
+            return False
+
+        table = self._table
+        legacy_table = f"{table}_legacy"
+        self.flush_model()
+        cr = self.env.cr
+        cr.execute(f'LOCK TABLE "{table}" IN ACCESS EXCLUSIVE MODE')
+        cr.execute(f'ALTER TABLE "{table}" RENAME TO "{legacy_table}"')
+        cr.execute(f'ALTER SEQUENCE "{table}_id_seq" OWNED BY NONE')
+        cr.execute(f"""CREATE TABLE "{table}" (LIKE "{legacy_table}" INCLUDING DEFAULTS)
+            PARTITION BY RANGE (create_date)
+        """)
+
+        # partitions for all logged months, and a default
+        # partition for logs outside of them
+        cr.execute(f"""UPDATE "{legacy_table}" SET create_date = COALESCE(write_date, NOW() AT TIME ZONE 'UTC')
+            WHERE create_date IS NULL
+        """)
+        cr.execute(f'SELECT MIN(create_date) FROM "{legacy_table}"')
+        first_date = cr.fetchone()[0]
+        month = (first_date or datetime.now()).date().replace(day=1)
+        this_month = fields.Date.today().replace(day=1)
+        while month < this_month:
+            self._log_partition_create(month)
+            month += relativedelta(months=1)
+        self._log_partition_ensure()
+        cr.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+
+        cr.execute(f'INSERT INTO "{table}" SELECT * FROM "{legacy_table}"')
+        cr.execute(f'DROP TABLE "{legacy_table}"')
+        cr.execute(f'ALTER SEQUENCE "{table}_id_seq" OWNED BY "{table}".id')
+
+        # the primary key has to contain the partition key
+        cr.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_pkey" PRIMARY KEY (id, create_date)')
+        for field in self._fields.values():
+            if not field.store or not field.column_type:
+                continue
+            if field.index:
+                cr.execute(f'CREATE INDEX "{table}__{field.name}_index" ON "{table}" ("{field.name}")')
+            if field.type == 'many2one':
+                comodel = self.env[field.comodel_name]
+                cr.execute(f"""ALTER TABLE "{table}" ADD CONSTRAINT "{table}_{field.name}_fkey"
+                    FOREIGN KEY ("{field.name}") REFERENCES "{comodel._table}" (id)
+                    ON DELETE {field.ondelete.upper()}
+                """)
+
+        _logger.info("Log table %s partitioned by month", table)
+        return True
+
+    @api.model
+    def _log_cleanup(self, retention_days):
+        """ Remove logs older than the retention days, whole partitions
+            are dropped if the log table is partitioned
+            :return: True if logs were removed
+        """
+        limit_date = fields.Date.today() - timedelta(days=retention_days)
+        if not self._log_is_partitioned():
+            self.flush_model()
+            self.env.cr.execute(f'DELETE FROM "{self._table}" WHERE create_date < %s', (limit_date, ))
+            return bool(self.env.cr.rowcount)
+
+        dropped = False
+        for name, month in self._log_partition_list():
+            if month + relativedelta(months=1) <= limit_date:
+                self.env.cr.execute(f'DROP TABLE "{name}"')
+                _logger.info("Log partition %s dropped", name)
+                dropped = True
+        return dropped
+
+
+class AutomationTaskSignal(models.Model):
+    """ Signals of a running task, which are written outside of the task
+        transaction, to avoid concurrent updates of the task itself """
+    _name = "automation.task.signal"
+    _description = "Task Signal"
+    _rec_name = "task_id"
+
+    task_id = fields.Many2one("automation.task", "Task", required=True, ondelete="cascade", index=True)
+    heartbeat = fields.Datetime("Last Seen", readonly=True)
+    cancel_requested = fields.Boolean(readonly=True)
+
+    _task_uniq = models.Constraint("UNIQUE(task_id)", "Only one signal per task allowed")
+
 
 class TaskToken(models.Model):
     _name = "automation.task.token"
@@ -22,8 +22,8 @@ class IrHttp(models.AbstractModel):
         # check token
         registry = odoo.registry(dbname)
         with registry.cursor() as cr:
-            cr.execute("SELECT COUNT(id) FROM automation_task_token WHERE token = %s", (token,))
-            token = cr.fetchall()
+            cr.execute("SELECT id FROM automation_task_token WHERE token = %s LIMIT 1", (token,))
+            token = cr.fetchone()
             if not token:
                 raise BadRequest("Token not found")
             if request.session.uid:
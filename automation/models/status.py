@@ -1,15 +1,229 @@
+import io
+import os
+import gc
+import gzip
 import json
+import uuid
+import queue
+import pstats
+import cProfile
 import logging
+import threading
 import time
+from collections import defaultdict
+from datetime import datetime, timezone
+import psutil
 import requests
-from odoo import tools, exceptions
+from odoo import tools, exceptions, fields, models, sql_db
 
 _logger = logging.getLogger(__name__)
 
 
+HEARTBEAT_SQL = """INSERT INTO automation_task_signal (task_id, heartbeat)
+    VALUES (%s, NOW() AT TIME ZONE 'UTC')
+    ON CONFLICT (task_id) DO UPDATE SET heartbeat = EXCLUDED.heartbeat
+"""
+
+
+DEFAULT_CANCEL_CHECK_S = 10
+DEFAULT_MEMORY_CHECK_S = 10
+DEFAULT_LOG_BUFFER_SIZE = 100
+DEFAULT_LOG_BUFFER_MS = 1000
+DEFAULT_PROGRESS_INTERVAL_MS = 500
+DEFAULT_LOG_QUEUE_SIZE = 100
+DEFAULT_SHIP_RETRIES = 5
+STAGE_RESERVE_COUNT = 20
+PROFILE_STATS_LINES = 30
+
+# stage values written with the progress
+STAGE_PROGRESS_FIELDS = ("progress", "status", "date_end", "wall_time", "cpu_time", "sql_count")
+
+# log priorities, ordered by severity
+LOG_LEVELS = {
+    "x": 0,
+    "a": 1,
+    "e": 2,
+    "w": 3,
+    "n": 4,
+    "i": 5,
+    "d": 6,
+}
+ERROR_PRIORITIES = ("e", "x", "a")
+AGGREGATE_SAMPLE_REFS = 10
+SPILL_KEPT_PRIORITIES = ("e", "x", "a", "w")
+
+# python log levels mapped to log priorities
+PYTHON_LOG_PRIORITIES = [
+    (logging.CRITICAL, "a"),
+    (logging.ERROR, "e"),
+    (logging.WARNING, "w"),
+    (logging.INFO, "i"),
+]
+
+
+# statements to write the status, prepared per connection,
+# rows are passed as arrays
+PREPARED_SQL = {
+    "automation_log_insert": """(timestamp[], int, int[], int[], text[], text[], text[], text[], text[], int[]) AS
+        INSERT INTO automation_task_log(create_date, write_date, create_uid, write_uid, task_id, stage_id, pri, message, ref, code, data, count)
+        SELECT v.create_date, v.create_date, $2, $2, v.task_id, v.stage_id, v.pri, v.message, v.ref, v.code, v.data::jsonb, v.count
+        FROM unnest($1, $3, $4, $5, $6, $7, $8, $9, $10) AS v(create_date, task_id, stage_id, pri, message, ref, code, data, count)
+    """,
+    "automation_progress_update": """(int[], float8[], text[], timestamp[], float8[], float8[], int[]) AS
+        UPDATE automation_task_stage s
+        SET progress = COALESCE(v.progress, s.progress),
+            status = COALESCE(v.status, s.status),
+            date_end = COALESCE(v.date_end, s.date_end),
+            wall_time = COALESCE(v.wall_time, s.wall_time),
+            cpu_time = COALESCE(v.cpu_time, s.cpu_time),
+            sql_count = COALESCE(v.sql_count, s.sql_count)
+        FROM unnest($1, $2, $3, $4, $5, $6, $7) AS v(id, progress, status, date_end, wall_time, cpu_time, sql_count)
+        WHERE s.id = v.id
+    """,
+    "automation_stage_insert": """(int, int, text, int, float8, text, int, timestamp) AS
+        INSERT INTO automation_task_stage(create_date, write_date, create_uid, write_uid, task_id, name, parent_id, progress, status, total, date_start)
+        VALUES (NOW() AT TIME ZONE 'UTC', NOW() AT TIME ZONE 'UTC', $1, $1, $2, $3, $4, $5, $6, $7, $8)
+        RETURNING id
+    """,
+}
+
+
 class AutomationTaskRequeueException(Exception):
     pass
 
+
+class AutomationTaskCancelException(Exception):
+    pass
+
+
+class AutomationTaskMemoryException(AutomationTaskRequeueException):
+    pass
+
+class TaskHeartbeat(threading.Thread):
+    """ Writes the heartbeat of a running task periodically within its
+        own cursor, tasks without heartbeat are recovered by the queue.
+        The heartbeat is stored as task signal, because an update of the
+        task would conflict with the task transaction """
+
+    def __init__(self, task, interval_s):
+        super().__init__(name=f"automation-heartbeat-{task.id}", daemon=True)
+        self.task_id = task.id
+        self.registry = task.pool
+        self.interval_s = interval_s
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval_s):
+            try:
+                with self.registry.cursor() as cr:
+                    cr.execute(HEARTBEAT_SQL, (self.task_id, ))
+            # pylint: disable=broad-exception-caught
+            except Exception:
+                _logger.exception("Heartbeat of task %s failed", self.task_id)
+
+    def __enter__(self):
+        # tests run within one transaction
+        if not tools.config.get('test_enable'):
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.is_alive():
+            self.stop_event.set()
+            self.join()
+
+
+class TaskShipper(threading.Thread):
+    """ Sends the batches of a remote task status in the background,
+        the task only blocks if the queue is full """
+
+    def __init__(self, session, url, queue_size, retries=DEFAULT_SHIP_RETRIES):
+        super().__init__(name="automation-shipper", daemon=True)
+        self.session = session
+        self.url = url
+        self.retries = retries
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+
+    def run(self):
+        while True:
+            ops = self.queue.get()
+            try:
+                if ops is None:
+                    return
+                # drop everything after an error
+                if self.error is None:
+                    self._send(ops)
+            finally:
+                self.queue.task_done()
+
+    def _send(self, ops):
+        delay_s = 1
+        for retry in range(self.retries + 1):
+            try:
+                with self.session.post(self.url, json=ops, timeout=120) as res:
+                    res.raise_for_status()
+                return
+            except requests.RequestException as e:
+                if retry >= self.retries:
+                    _logger.exception("Sending task logs failed")
+                    self.error = e
+                    return
+                _logger.warning("Sending task logs failed, retry in %s s", delay_s)
+                time.sleep(delay_s)
+                delay_s *= 2
+
+    def put(self, ops):
+        """ Queue the operations, blocks if the queue is full """
+        if self.error is not None:
+            raise self.error
+        self.queue.put(ops)
+
+    def wait(self):
+        """ Wait until all queued operations are sent """
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+
+class TaskLogHandler(logging.Handler):
+    """ Forwards python log records of the task thread into the task log """
+
+    def __init__(self, taskc, level=logging.WARNING):
+        super().__init__(level)
+        self.taskc = taskc
+        self.thread_id = threading.get_ident()
+        self.ignored = {_logger.name}
+        if taskc.logger:
+            self.ignored.add(taskc.logger.name)
+        self._emitting = False
+
+    def filter(self, record):
+        # ignore records of other threads, of the status itself,
+        # or records which are logged while forwarding
+        if record.thread != self.thread_id or self._emitting or record.name in self.ignored:
+            return False
+        return super().filter(record)
+
+    def emit(self, record):
+        self._emitting = True
+        try:
+            message = record.getMessage()
+            if record.exc_info:
+                message = f"{message}\n{logging.Formatter().formatException(record.exc_info)}"
+            pri = next((pri for level, pri in PYTHON_LOG_PRIORITIES if record.levelno >= level), "d")
+            self.taskc.log(message, pri=pri, data={"logger": record.name})
+        # pylint: disable=broad-exception-caught
+        except Exception:
+            self.handleError(record)
+        finally:
+            self._emitting = False
+
+
 class TaskStatus(object):
     """ This class is used to log the progress of a task. """
 
@@ -36,15 +250,75 @@ class TaskStatus(object):
         self.last_status = None
         self.errors = 0
         self.warnings = 0
+        self.subtasks = 0
+        self.resume_state = task.checkpoint
         self.test = test
         self.uid = task.env.uid
 
+        # init log threshold and sampling
+        param_obj = task.env["ir.config_parameter"].sudo()
+        log_level = self.options.get("log_level") or param_obj.get_param("automation.log_level") or "d"
+        self._log_level = LOG_LEVELS[log_level]
+        self._log_sample = int(self.options.get("log_sample") or param_obj.get_param("automation.log_sample") or 0)
+        self._sample_counts = defaultdict(int)
+        self._sample_dropped = {}
+
+        # init aggregation of logs with the same stage, priority and code
+        self._log_aggregate = self.options.get("log_aggregate", False)
+        self._aggregates = {}
+
+        # init capture of python logs
+        self._log_handler = None
+
+        # init spill file, only errors and
+        # warnings are written to the database
+        self._log_spill = self.options.get("log_spill", False)
+        self._spill = None
+        self._spill_fname = None
+        self._spill_count = 0
+
+        # init stage timing, and optional profiling
+        # of the stages below the root stage
+        self._stage_timers = {}
+        self._profile_stages = self.options.get("profile_stages", False)
+        self._profile = None
+
         # init loop
         self._loop_inc = 0.0
         self._loop_progress = 0.0
         self._loop_start_time = None
         self._loop_max_duration_s = 0
 
+        # init cancel check
+        self._cancel_check_s = self.options.get("cancel_check_s", DEFAULT_CANCEL_CHECK_S)
+        self._cancel_check_time = time.time()
+
+        # init memory watchdog, checked in loop_next
+        max_memory_mb = self.options.get("max_memory_mb") or task.env["ir.config_parameter"].sudo().get_param("automation.max_memory_mb")
+        self._max_memory_mb = int(max_memory_mb or 0)
+        self._memory_check_s = self.options.get("memory_check_s", DEFAULT_MEMORY_CHECK_S)
+        self._memory_check_time = time.time()
+
+        # init log buffer, logs and progress are
+        # written in batches
+        self._log_buffer = []
+        self._progress_buffer = {}
+        self._buffer_size = self.options.get("log_buffer_size", DEFAULT_LOG_BUFFER_SIZE)
+        self._buffer_time_s = self.options.get("log_buffer_ms", DEFAULT_LOG_BUFFER_MS) / 1000.0
+        self._buffer_flush_time = time.time()
+
+        # init progress throttling
+        self._progress_interval_s = self.options.get("progress_interval_ms", DEFAULT_PROGRESS_INTERVAL_MS) / 1000.0
+        self._progress_time = 0.0
+        self._pending_progress = None
+
+        # init status cursor, or session if remote
+        self._cr = None
+        self._prepared_cr = None
+        self._session = None
+        self._shipper = None
+        self._stage_ids = []
+
         # init task
         self.task = task
         self.env = task.env
@@ -85,6 +359,8 @@ class TaskStatus(object):
                 self.log_path = f"{baseurl}/automation/log"
                 self.stage_path = f"{baseurl}/automation/stage"
                 self.progress_path = f"{baseurl}/automation/progress"
+                self.batch_path = f"{baseurl}/automation/batch"
+                self.reserve_path = f"{baseurl}/automation/stage/reserve"
 
                 # prepare header
                 self.headers = {
@@ -92,6 +368,19 @@ class TaskStatus(object):
                     'X-Automation-Token': self.token,
                     'X-Automation-DB': self.db
                 }
+
+                # keep connection alive
+                self._session = requests.Session()
+                self._session.headers.update(self.headers)
+
+                # send logs in the background
+                if self.options.get("log_async"):
+                    shipper_session = requests.Session()
+                    shipper_session.headers.update(self.headers)
+                    self._shipper = TaskShipper(shipper_session,
+                                                self.batch_path,
+                                                self.options.get("log_queue_size", DEFAULT_LOG_QUEUE_SIZE))
+                    self._shipper.start()
             else:
                 # set paths
                 self.log_path = "log"
@@ -100,7 +389,7 @@ class TaskStatus(object):
 
         # setup root stage
         # first call to remote
-        self.root_stage_id = self._create_stage({"name": task.name, "total": total})
+        self.root_stage_id = self._start_stage({"name": task.name, "total": total})
         self.parent_stage_id = self.root_stage_id
         self.stage_id = self.root_stage_id
 
@@ -111,120 +400,301 @@ class TaskStatus(object):
 
     def _post_data(self, url, data, result_parser=lambda res: None):
         if self.token:
-            with requests.post(url, data=data, headers=self.headers, timeout=120) as res:
+            with self._session.post(url, data=data, timeout=120) as res:
                 res.raise_for_status()
                 return result_parser(res)
+        elif url == "stage":
+            # create stage
+            def write_stage(cr):
+                self._prepare(cr)
+                cr.execute("EXECUTE automation_stage_insert (%s, %s, %s, %s, %s, %s, %s, %s)", (
+                    self.uid,
+                    data["task_id"],
+                    data["name"],
+                    data.get('parent_id', None),
+                    data.get('progress', 0),
+                    data.get('status', ''),
+                    data.get('total', None),
+                    data.get('date_start', None)
+                ))
+                return cr.fetchone()[0]
+            return self._write(write_stage)
+        return None
+
+    def _get_cursor(self):
+        """ :return: cursor used for all writes during the lifetime of the status """
+        if self.test:
+            # write data straight ahead for testing
+            return self.task.env.cr
+        if self._cr is None:
+            self._cr = self.task.pool.cursor()
+        return self._cr
+
+    def _write(self, write_data):
+        """ Run the write (or read) with the status cursor, and commit it """
+        cr = self._get_cursor()
+        try:
+            res = write_data(cr)
+            if not self.test:
+                cr.commit()
+            return res
+        except Exception:
+            if not self.test:
+                cr.rollback()
+            raise
+
+    def _prepare(self, cr):
+        """ Prepare the write statements, once per connection """
+        if self._prepared_cr is cr:
+            return
+        cr.execute("SELECT name FROM pg_prepared_statements WHERE name IN %s", (tuple(PREPARED_SQL), ))
+        prepared = {r[0] for r in cr.fetchall()}
+        for name, statement in PREPARED_SQL.items():
+            if name not in prepared:
+                cr.execute(f"PREPARE {name} {statement}")
+        self._prepared_cr = cr
+
+    def _release_cursor(self):
+        """ Remove the prepared statements and close the status cursor """
+        cr, self._cr = self._cr, None
+        if cr is None:
+            return
+        try:
+            if self._prepared_cr is cr:
+                cr.rollback()
+                for name in PREPARED_SQL:
+                    cr.execute(f"DEALLOCATE {name}")
+                cr.commit()
+        finally:
+            self._prepared_cr = None
+            cr.close()
+
+    def _write_batch(self, cr, logs, progress):
+        """ Write logs with one insert, and the progress of stages
+            with one update, rows are passed as arrays """
+        self._prepare(cr)
+        if logs:
+            cr.execute("EXECUTE automation_log_insert (%s::timestamp[], %s, %s::int[], %s::int[], %s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::int[])", (
+                [data["create_date"] for data in logs],
+                self.uid,
+                [data["task_id"] for data in logs],
+                [data["stage_id"] for data in logs],
+                [data["pri"] for data in logs],
+                [data.get('message') or '' for data in logs],
+                [data.get('ref') or '' for data in logs],
+                [data.get('code') or '' for data in logs],
+                [data.get('data') or None for data in logs],
+                [data.get('count', 1) for data in logs],
+            ))
+
+        if progress:
+            cr.execute("EXECUTE automation_progress_update (%s::int[], %s::float8[], %s::text[], %s::timestamp[], %s::float8[], %s::float8[], %s::int[])", (
+                list(progress),
+                [values.get("progress") for values in progress.values()],
+                [values.get("status") for values in progress.values()],
+                [values.get("date_end") for values in progress.values()],
+                [values.get("wall_time") for values in progress.values()],
+                [values.get("cpu_time") for values in progress.values()],
+                [values.get("sql_count") for values in progress.values()],
+            ))
+
+    def _post_batch(self, logs, progress):
+        if self.token:
+            # send all operations with one request
+            ops = []
+            for data in logs:
+                data = data.copy()
+                data.pop("create_date")
+                data["op"] = "log"
+                ops.append(data)
+            for stage_id, values in progress.items():
+                ops.append(dict(values, op="progress", stage_id=stage_id))
+            if self._shipper:
+                self._shipper.put(ops)
+            else:
+                with self._session.post(self.batch_path, json=ops, timeout=120) as res:
+                    res.raise_for_status()
+        elif self.local:
+            self._write_local(logs, progress)
         else:
-            # copy data for local push
+            self._write(lambda cr: self._write_batch(cr, logs, progress))
+
+    def _write_local(self, logs, progress):
+        """ Create logs with one create, references
+            are resolved with one query per model """
+        ref_ids = defaultdict(set)
+        for data in logs:
+            ref = data.get("ref")
+            if ref:
+                ref_obj, ref_id = ref.split(",")
+                ref_ids[ref_obj].add(int(ref_id))
+
+        ref_names = {}
+        for ref_obj, ids in ref_ids.items():
+            for obj in self.log_obj.env[ref_obj].browse(ids).exists():
+                ref_names[(ref_obj, obj.id)] = obj.display_name
+
+        vals_list = []
+        for data in logs:
             data = data.copy()
+            data.pop("create_date")
+            # json is encoded for the sql and http writes
+            if data.get("data"):
+                data["data"] = json.loads(data["data"])
+            ref = data.get("ref")
+            if ref:
+                ref_obj, ref_id = ref.split(",")
+                ref_name = ref_names.get((ref_obj, int(ref_id)))
+                if ref_name is not None:
+                    data["message"] = f"{data['message']} ({ref_id}, '{ref_name}')"
+                else:
+                    data["message"] = f"{data['message']} ({ref})"
+            vals_list.append(data)
+        self.log_obj.create(vals_list)
 
-            # write data to database
-            def write_data(cr):
-
-                def update_progress():
-                    progress = data.pop("progress", None)
-                    status = data.pop("status", None)
-                    stage_id = data["stage_id"]
-                    if status and progress:
-                        cr.execute('UPDATE automation_task_stage SET progress = %s, status = %s WHERE id = %s', (progress, status, stage_id))
-                    elif progress:
-                        cr.execute('UPDATE automation_task_stage SET progress = %s WHERE id = %s', (progress, stage_id))
-                    elif status:
-                        cr.execute('UPDATE automation_task_stage SET status = %s WHERE id = %s', (status, stage_id))
-                    return stage_id
-
-                if url == "log":
-                    update_progress()
-                    # create log
-                    cr.execute("""
-                        INSERT INTO automation_task_log(create_date, write_date, create_uid, write_uid, task_id, stage_id, pri, message, ref, code, data)
-                        VALUES (NOW() at time zone 'UTC', NOW() at time zone 'UTC', %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING ID
-                    """, (self.uid,
-                        self.uid,
-                        data["task_id"],
-                        data["stage_id"],
-                        data["pri"],
-                        data.get('message') or '',
-                        data.get('ref') or '',
-                        data.get('code') or '',
-                        data.get('data') or None
-                    ))
-                    log_id = cr.fetchone()[0]
-                    return log_id
-                elif url == "stage":
-                    # create stage
-                    cr.execute("""
-                        INSERT INTO automation_task_stage(create_date, write_date, create_uid, write_uid, task_id, name, parent_id, progress, status, total)
-                        VALUES (NOW() at time zone 'UTC', NOW() at time zone 'UTC', %s, %s, %s, %s, %s, %s, %s, %s) RETURNING ID
-                    """, (self.uid,
-                        self.uid,
-                        data["task_id"],
-                        data["name"],
-                        data.get('parent_id', None),
-                        data.get('progress', 0),
-                        data.get('status', ''),
-                        data.get('total', None)
-                    ))
-                    stage_id = cr.fetchone()[0]
-                    return stage_id
-                elif url == "progress":
-                    return update_progress()
+        for stage_id, values in progress.items():
+            self.stage_obj.browse(stage_id).write(values)
 
-            if not self.test:
-                # create second cursor for commit
-                with self.task.pool.cursor() as cr:
-                    return write_data(cr)
-            else:
-                # write data straight ahead for testing
-                return write_data(self.task.env.cr)
+    def _ship_stage(self, data):
+        """ Queue the stage with an id reserved on the server,
+            ids are reserved in ranges """
+        if not self._stage_ids:
+            with self._session.post(self.reserve_path, data={"count": STAGE_RESERVE_COUNT}, timeout=120) as res:
+                res.raise_for_status()
+                self._stage_ids = res.json()
+        stage_id = self._stage_ids.pop(0)
+        self._shipper.put([dict(data, op="stage", id=stage_id)])
+        return stage_id
+
+    def _check_flush(self):
+        if len(self._log_buffer) >= self._buffer_size or time.time() - self._buffer_flush_time >= self._buffer_time_s:
+            self.flush()
+
+    def flush(self):
+        """ Write buffered logs and progress """
+        self._buffer_flush_time = time.time()
+        if self._log_buffer or self._progress_buffer:
+            logs, self._log_buffer = self._log_buffer, []
+            progress, self._progress_buffer = self._progress_buffer, {}
+            self._post_batch(logs, progress)
+
+    def _buffer_progress(self, data):
+        values = self._progress_buffer.setdefault(data["stage_id"], {})
+        for key in STAGE_PROGRESS_FIELDS:
+            if data.get(key) is not None:
+                values[key] = data[key]
 
     def _post_progress(self, data):
-        if self.local:
-            self.stage_obj.browse(data["stage_id"]).write({
-                "task_id": self.task.id,
-                "status": data["status"],
-                "progress": data["progress"],
-            })
-        else:
-            self._post_data(self.progress_path, data)
+        self._buffer_progress(data)
+        self._check_flush()
 
     def _post_stage(self, data):
         if self.logger:
             self.logger.info("= Stage %s", data["name"])
         data["task_id"] = self.task.id
+        self.flush()
         if self.local:
             return self.stage_obj.create(data).id
         else:
+            if self._shipper:
+                return self._ship_stage(data)
             return self._post_data(self.stage_path,
                                    data,
                                    result_parser=lambda res: int(res.text))
 
-    def _post_log(self, data):
-        # check for local logging
-        data["task_id"] = self.task.id
-        if self.local:
-
-            ref = data.get("ref")
-            if ref:
-                ref_parts = ref.split(",")
-                ref_obj = ref_parts[0]
-                ref_id = int(ref_parts[1])
-                obj = self.log_obj.env[ref_obj].browse(ref_id).exists()
-                if obj:
-                    data["message"] = f"{data['message']} ({obj.id}, '{obj.display_name}')"
-                else:
-                    data["message"] = f"{data['message']} ({ref})"
-
-            # add progress
-            if "progress" in data:
-                progress = data.pop("progress", 0.0)
-                self.task.env["automation.task.stage"].browse(self.stage_id).write({"progress": progress})
-
-            self.log_obj.create(data)
+    def _buffer_log(self, data):
+        # buffer log, errors
+        # are written immediately
+        self._log_buffer.append(data)
+        if data["pri"] in ERROR_PRIORITIES:
+            self.flush()
+        else:
+            self._check_flush()
+
+    def _spill_log(self, data):
+        """ Write the log as json line to the compressed spill file """
+        if self._spill is None:
+            attachment_obj = self.env["ir.attachment"]
+            self._spill_fname = f"automation/task_{self.task.id}_{uuid.uuid4().hex}"
+            path = attachment_obj._full_path(self._spill_fname)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # removed by the filestore gc, if not attached
+            attachment_obj._mark_for_gc(self._spill_fname)
+            self._spill = gzip.open(path, "wt", encoding="utf-8")
+
+        line = {
+            "date": data["create_date"].isoformat(),
+            "stage_id": data["stage_id"],
+            "pri": data["pri"],
+            "message": data["message"],
+        }
+        for key in ("ref", "code", "count"):
+            if data.get(key):
+                line[key] = data[key]
+        if data.get("data"):
+            line["data"] = json.loads(data["data"])
+        self._spill.write(json.dumps(line) + "\n")
+        self._spill_count += 1
+
+    def _close_spill(self):
+        """ Close the spill file, and log a summary """
+        spill, self._spill = self._spill, None
+        if spill is None:
+            return
+        spill.close()
+
+        self._buffer_log({
+            "task_id": self.task.id,
+            "stage_id": self.root_stage_id,
+            "pri": "i",
+            "message": self.env._("%s messages written to the log file", self._spill_count),
+            "create_date": datetime.now(timezone.utc).replace(tzinfo=None),
+        })
+
+    def attach_spill(self, task=None):
+        """ Attach the closed spill file to the task, a failed task
+            attaches it after the rollback of its transaction
+            :param task: task to attach the file to, within its environment
+        """
+        fname = self._spill_fname
+        if not fname or self._spill is not None:
+            return
+        self._spill_fname = None
+
+        task = (task or self.task).sudo()
+        attachment_obj = task.env["ir.attachment"]
+        attachment = attachment_obj.create({
+            "name": f"task_{task.id}.ndjson.gz",
+            "res_model": "automation.task",
+            "res_id": task.id,
+        })
+        # the file is already in the filestore
+        task.env.cr.execute(
+            "UPDATE ir_attachment SET store_fname = %s, file_size = %s, mimetype = %s WHERE id = %s",
+            (fname, os.path.getsize(attachment_obj._full_path(fname)), "application/gzip", attachment.id))
+        attachment.invalidate_recordset(["store_fname", "file_size", "mimetype"])
+        old_attachment = task.spill_attachment_id
+        task.spill_attachment_id = attachment
+        old_attachment.unlink()
+
+        # the linked file is no longer collected by the filestore gc
+        checklist_path = os.path.join(attachment_obj._full_path("checklist"), fname)
+
+        def remove_checklist():
+            if os.path.exists(checklist_path):
+                os.unlink(checklist_path)
+
+        task.env.cr.postcommit.add(remove_checklist)
 
-        # otherwise forward log to server
+    def _post_log(self, data):
+        data = dict(data, task_id=self.task.id)
+        if "progress" in data:
+            self._buffer_progress({"stage_id": data["stage_id"], "progress": data.pop("progress")})
+        data["create_date"] = datetime.now(timezone.utc).replace(tzinfo=None)
+        if self._log_spill and data["pri"] not in SPILL_KEPT_PRIORITIES:
+            self._spill_log(data)
         else:
-            self._post_data(self.log_path, data)
+            self._buffer_log(data)
 
         # log message
         if self.logger:
@@ -233,26 +703,94 @@ class TaskStatus(object):
             if pri == "i":
                 self.logger.info(message)
             elif pri == "e":
-                self.errors += 1
                 self.logger.error(message)
             elif pri == "w":
-                self.warnings += 1
                 self.logger.warning(message)
             elif pri == "d":
                 self.logger.debug(message)
             elif pri == "x":
-                self.errors += 1
                 self.logger.fatal(message)
             elif pri == "a":
-                self.errors += 1
                 self.logger.critical(message)
 
+    def _is_logged(self, pri, code):
+        """ Check the threshold, and keep only the first lines
+            of a code if sampled, errors are always kept """
+        if LOG_LEVELS[pri] > self._log_level:
+            return False
+        if self._log_sample and code and pri not in ERROR_PRIORITIES:
+            self._sample_counts[code] += 1
+            if self._sample_counts[code] > self._log_sample:
+                dropped_pri, dropped = self._sample_dropped.get(code, (pri, 0))
+                if LOG_LEVELS[pri] < LOG_LEVELS[dropped_pri]:
+                    dropped_pri = pri
+                self._sample_dropped[code] = (dropped_pri, dropped + 1)
+                return False
+        return True
+
+    def _log_sample_summary(self):
+        """ Log the number of dropped lines per code """
+        dropped, self._sample_dropped = self._sample_dropped, {}
+        for code, (pri, count) in dropped.items():
+            self._post_log({
+                "stage_id": self.root_stage_id,
+                "pri": pri,
+                "message": self.env._("%(count)s more messages not logged", count=count),
+                "code": code,
+                "data": json.dumps({"dropped": count}),
+                "count": count,
+            })
+
+    def _aggregate(self, message, pri, code, obj=None, ref=None, progress=None):
+        """ Collapse the log into one log per stage, priority and code,
+            with the count and a sample of the references """
+        if progress:
+            self._post_progress({"stage_id": self.stage_id, "progress": progress})
+        if obj:
+            ref = f"{obj._name},{obj.id}"
+
+        key = (self.stage_id, pri, code)
+        aggregate = self._aggregates.get(key)
+        if aggregate is None:
+            aggregate = self._aggregates[key] = {"message": message, "count": 0, "refs": []}
+        aggregate["count"] += 1
+        if ref and len(aggregate["refs"]) < AGGREGATE_SAMPLE_REFS:
+            aggregate["refs"].append(ref)
+
+    def _flush_aggregates(self, stage_id=None):
+        """ Log the collapsed logs of the stage, or of all stages """
+        for key in list(self._aggregates):
+            if stage_id is not None and key[0] != stage_id:
+                continue
+            aggregate = self._aggregates.pop(key)
+            values = {
+                "stage_id": key[0],
+                "pri": key[1],
+                "code": key[2],
+                "message": aggregate["message"],
+                "count": aggregate["count"],
+                "data": json.dumps({"refs": aggregate["refs"]}),
+            }
+            if aggregate["refs"]:
+                values["ref"] = aggregate["refs"][0]
+            self._post_log(values)
+
     def log(self, message, pri="i", obj=None, ref=None, progress=None, code=None, data=None):
-        if pri == "e":
+        if pri in ERROR_PRIORITIES:
             self.errors += 1
         elif pri == "w":
             self.warnings += 1
 
+        # counters are kept for dropped lines
+        if not self._is_logged(pri, code):
+            if progress:
+                self._post_progress({"stage_id": self.stage_id, "progress": progress})
+            return
+
+        if self._log_aggregate and code:
+            self._aggregate(message, pri, code, obj=obj, ref=ref, progress=progress)
+            return
+
         if not data is None and not isinstance(data, str):
             data = json.dumps(data)
 
@@ -266,7 +804,7 @@ class TaskStatus(object):
         if progress:
             values["progress"] = progress
         if obj:
-            ref = f"{obj.name},{obj.id}"
+            ref = f"{obj._name},{obj.id}"
         if ref:
             values["ref"] = ref
 
@@ -290,6 +828,30 @@ class TaskStatus(object):
     def logx(self, message, pri="x", **kwargs):
         self.log(message, pri=pri, **kwargs)
 
+    def _is_cancel_requested(self):
+        def read_request(cr):
+            cr.execute("SELECT cancel_requested FROM automation_task_signal WHERE task_id = %s", (self.task.id, ))
+            row = cr.fetchone()
+            return bool(row and row[0])
+
+        if self.test:
+            self.env["automation.task.signal"].flush_model()
+        # the task transaction does not see the request,
+        # check with the status cursor
+        return self._write(read_request)
+
+    def check_cancel(self):
+        """ Abort the task if a cancel was requested, the request
+            is checked at most once every cancel_check_s seconds """
+        now = time.time()
+        if now - self._cancel_check_time < self._cancel_check_s:
+            return
+        self._cancel_check_time = now
+        if self._is_cancel_requested():
+            message = self.env._("Cancel requested, aborting!")
+            self.logw(message, code="CANCEL")
+            raise AutomationTaskCancelException(message)
+
     def loop_init(self, loop_count, status=None, max_duration_s=0):
         self._loop_progress = 0.0
         self._loop_start_time = time.time()
@@ -302,17 +864,48 @@ class TaskStatus(object):
             self._loop_progress = 0.0
         self.progress(status, self._loop_progress)
 
+    def _memory_mb(self):
+        """ :return: resident memory of the process in MB """
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+
+    def check_memory(self):
+        """ Requeue the task if the memory limit is reached, after the
+            cache was cleared. The memory is checked at most once every
+            memory_check_s seconds """
+        now = time.time()
+        if not self._max_memory_mb or now - self._memory_check_time < self._memory_check_s:
+            return
+        self._memory_check_time = now
+        if self._memory_mb() < self._max_memory_mb:
+            return
+
+        # free the cache of the task first
+        self.env.invalidate_all()
+        gc.collect()
+        memory_mb = self._memory_mb()
+        if memory_mb >= self._max_memory_mb:
+            message = self.env._('Memory limit of %(limit)s MB reached (%(memory)s MB), initiating requeue!',
+                                 limit=self._max_memory_mb, memory=round(memory_mb))
+            self.logw(message, code='REQUEUE')
+            raise AutomationTaskMemoryException(message)
+
     def loop_next(self, status=None, step=1):
         # check if is time for requeue
         if self._loop_max_duration_s and time.time() - self._loop_start_time > self._loop_max_duration_s:
             message = self.env._('Limit of %s sec reached, initiating requeue!', self._loop_max_duration_s)
             self.logw(message, code='REQUEUE')
             raise AutomationTaskRequeueException(message)
+        self.check_memory()
 
         self._loop_progress += self._loop_inc * step
         self.progress(status, self._loop_progress)
 
     def progress(self, status, progress):
+        self.check_cancel()
+        # buffered logs are written in time,
+        # also if no further logs follow
+        if self._log_buffer:
+            self._check_flush()
         values = {
             "stage_id": self.stage_id,
             "task_id": self.task.id,
@@ -321,41 +914,197 @@ class TaskStatus(object):
         }
         if self.last_status is None or self.last_status != values:
             self.last_status = values
+            # keep only the latest progress
+            # within the progress interval
+            now = time.time()
+            if now - self._progress_time < self._progress_interval_s:
+                self._pending_progress = values
+            else:
+                self._progress_time = now
+                self._pending_progress = None
+                self._post_progress(values)
+
+    def _flush_progress(self):
+        values, self._pending_progress = self._pending_progress, None
+        if values:
+            self._progress_time = time.time()
             self._post_progress(values)
 
     def _create_stage(self, values):
         return self._post_stage(values)
 
+    def _start_stage(self, values):
+        """ Create the stage, and start measuring its wall time,
+            cpu time and sql statements """
+        values["date_start"] = fields.Datetime.to_string(fields.Datetime.now())
+        stage_id = self._create_stage(values)
+        if self._profile_stages and self._profile is None and values.get("parent_id"):
+            # profiles can not be nested
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self._profile = (stage_id, values["name"], profile)
+            except ValueError:
+                _logger.warning("Profiler of stage %s could not be enabled, another profiler is active", values["name"])
+        self._stage_timers[stage_id] = (time.time(), time.thread_time(), sql_db.sql_counter)
+        return stage_id
+
+    def _end_stage(self, stage_id):
+        """ Write the measured times and sql statements of the stage """
+        timer = self._stage_timers.pop(stage_id, None)
+        if timer is None:
+            return
+        wall_start, cpu_start, sql_start = timer
+        self._buffer_progress({
+            "stage_id": stage_id,
+            "date_end": fields.Datetime.to_string(fields.Datetime.now()),
+            "wall_time": round(time.time() - wall_start, 3),
+            "cpu_time": round(time.thread_time() - cpu_start, 3),
+            "sql_count": sql_db.sql_counter - sql_start,
+        })
+
+        if self._profile and self._profile[0] == stage_id:
+            _stage_id, name, profile = self._profile
+            self._profile = None
+            profile.disable()
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(PROFILE_STATS_LINES)
+            self._post_log({
+                "stage_id": stage_id,
+                "pri": "i",
+                "message": self.env._("Profile of %(name)s\n%(stats)s", name=name, stats=stream.getvalue()),
+                "code": "PROFILE",
+            })
+
+    def _end_stages(self):
+        """ End all stages, which are still measured """
+        for stage_id in reversed(list(self._stage_timers)):
+            self._end_stage(stage_id)
+
     def stage(self, subject, total=None):
+        self.check_cancel()
+        self._flush_progress()
         values = {"parent_id": self.parent_stage_id, "name": subject}
         if total:
             values["total"] = total
         self.stage_stack.append((self.parent_stage_id, self.stage_id))
-        self.stage_id = self._create_stage(values)
+        self.stage_id = self._start_stage(values)
 
     def substage(self, subject, total=None):
+        self.check_cancel()
+        self._flush_progress()
         values = {"parent_id": self.stage_id, "name": subject}
         if total:
             values["total"] = total
         self.stage_stack.append((self.parent_stage_id, self.stage_id))
         self.parent_stage_id = self.stage_id
-        self.stage_id = self._create_stage(values)
+        self.stage_id = self._start_stage(values)
 
     def done(self):
         self.progress(self.env._("Done"), 100.0)
+        self._flush_progress()
+        self._flush_aggregates(self.stage_id)
+        if self.stage_id != self.root_stage_id:
+            self._end_stage(self.stage_id)
+        self.flush()
         if self.stage_stack:
             self.parent_stage_id, self.stage_id = self.stage_stack.pop()
 
+    def checkpoint(self, state):
+        """ Save the state to resume from, after the task was requeued.
+            The checkpoint is written within the task transaction,
+            and therefore committed together with the work done
+            :param state: json serializable state, e.g. the last processed id
+        """
+        self.resume_state = state
+        self.task.write({"checkpoint": state})
+
+    def fan_out(self, ids, chunk_size, method, subject=None):
+        """ Split the work into chunks, which are processed as parallel
+            subtasks, the task finishes after all subtasks finished
+            :param ids: ids or recordset to split
+            :param int chunk_size: ids per subtask
+            :param str method: method of the task resource starting with _run_chunk, called with (taskc, chunk)
+            :param str subject: name of the stage showing the subtask progress
+            :return: subtasks
+        """
+        model = None
+        if isinstance(ids, models.BaseModel):
+            model = ids._name
+            ids = ids.ids
+        chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+        if not chunks:
+            return self.task.browse()
+
+        stage_id = self._create_stage({
+            "parent_id": self.stage_id,
+            "name": subject or self.env._("Subtasks"),
+            "total": len(chunks),
+        })
+        if self._shipper:
+            # subtasks reference the stage
+            self._shipper.wait()
+        tasks = self.task._task_fan_out(method, chunks, model=model, stage_id=stage_id)
+        self.subtasks += len(tasks)
+        self.log(self.env._("%s subtasks queued", len(tasks)))
+        return tasks
+
     def close(self):
-        self._post_progress({"stage_id": self.root_stage_id, "status": self.env._("Done"), "progress": 100.0})
+        self._flush_progress()
+        self._end_stages()
+        self._flush_aggregates()
+        self._log_sample_summary()
+        self._close_spill()
+        self.attach_spill()
+        if self.subtasks:
+            # progress comes from the subtasks
+            self._post_progress({"stage_id": self.root_stage_id, "status": self.env._("Waiting for subtasks"), "progress": 0.0})
+        else:
+            self._post_progress({"stage_id": self.root_stage_id, "status": self.env._("Done"), "progress": 100.0})
+        self.flush()
+        if self._shipper:
+            self._shipper.wait()
 
     def __enter__(self):
+        # forward python logs of the task, if enabled,
+        # because they count as errors and warnings of the task
+        if self.options.get("log_capture", False):
+            level = self.options.get("log_capture_level", "WARNING")
+            self._log_handler = TaskLogHandler(self, level=logging.getLevelName(level))
+            logging.getLogger().addHandler(self._log_handler)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        # only close if there is no error
-        if exc_type is None:
-            self.close()
+        if self._log_handler is not None:
+            logging.getLogger().removeHandler(self._log_handler)
+            self._log_handler = None
+        try:
+            # only close if there is no error
+            if exc_type is None:
+                self.close()
+            else:
+                # keep the logs of the failure
+                try:
+                    self._flush_progress()
+                    self._end_stages()
+                    self._flush_aggregates()
+                    self._log_sample_summary()
+                    self._close_spill()
+                    self.flush()
+                # pylint: disable=broad-exception-caught
+                except Exception:
+                    _logger.exception("Flush of task %s logs failed", self.task.id)
+        finally:
+            if self._profile is not None:
+                self._profile[2].disable()
+                self._profile = None
+            self._release_cursor()
+            if self._shipper is not None:
+                self._shipper.stop()
+                self._shipper = None
+            if self._session is not None:
+                self._session.close()
+                self._session = None
 
 
 class TaskLogger:
@@ -370,6 +1119,7 @@ class TaskLogger:
         self._loop_progress = 0.0
         self.errors = 0
         self.warnings = 0
+        self.resume_state = None
         self.options = options if not options is None else {}
 
     # pylint: disable=unused-argument
@@ -385,8 +1135,10 @@ class TaskLogger:
         elif pri == "d":
             self.logger.debug(message)
         elif pri == "x":
+            self.errors += 1
             self.logger.fatal(message)
         elif pri == "a":
+            self.errors += 1
             self.logger.critical(message)
 
     def loge(self, message, pri="e", **kwargs):
@@ -439,5 +1191,17 @@ class TaskLogger:
     def done(self):
         self.progress("Done", 100.0)
 
+    def checkpoint(self, state):
+        self.resume_state = state
+
+    def check_cancel(self):
+        pass
+
+    def check_memory(self):
+        pass
+
+    def flush(self):
+        pass
+
     def close(self):
         pass
\ No newline at end of file
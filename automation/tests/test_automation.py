@@ -1,5 +1,15 @@
-from odoo.tests.common import TransactionCase
+import gzip
+import json
+import logging
+from unittest.mock import patch, MagicMock
+from dateutil.relativedelta import relativedelta
+import requests
+
+from odoo import exceptions, fields
+from odoo.tests.common import TransactionCase, HttpCase
 from odoo.tests import tagged
+from odoo.tools import mute_logger
+from odoo.addons.automation.models.status import TaskStatus, TaskShipper, AutomationTaskRequeueException
 
 
 @tagged('post_install', '-at_install')
@@ -43,4 +53,662 @@ class TestAutomation(TransactionCase):
 
         # check if task is requeued
         self.assertEqual(task.state, 'queued')
+        self.assertTrue(task.eta, 'Requeued task is delayed')
+
+    def test_automation_queue_drain(self):
+        tasks = self.env['automation.task'].create([
+            {'name': 'Test Task %s' % i} for i in range(3)
+        ])
+
+        # queue tasks
+        tasks.action_queue()
+        self.assertEqual(set(tasks.mapped('state')), {'queued'})
+
+        # drain queue
+        processed = self.env['automation.task']._process_queue()
+        self.assertEqual(processed, 3)
+        self.assertEqual(set(tasks.mapped('state')), {'done'})
+
+    def test_automation_queue_priority(self):
+        task_obj = self.env['automation.task']
+        task_low = task_obj.create({'name': 'Low Priority', 'priority': 20})
+        task_high = task_obj.create({'name': 'High Priority', 'priority': 5})
+        (task_low | task_high).action_queue()
+
+        # interactive task first
+        self.assertEqual(task_obj._task_dequeue()[0], task_high)
+        self.assertEqual(task_obj._task_dequeue(exclude_ids=task_high.ids)[0], task_low)
+
+    def test_automation_queue_channel(self):
+        self.env['ir.config_parameter'].sudo().set_param('automation.channels', 'root.import:1')
+        task_obj = self.env['automation.task']
+        task_import = task_obj.create({'name': 'Import', 'channel': 'root.import.partner'})
+        task_import_product = task_obj.create({'name': 'Import Product', 'channel': 'root.import.product'})
+        task_mail = task_obj.create({'name': 'Mail', 'channel': 'root.mail'})
+        (task_import | task_import_product | task_mail).action_queue()
+
+        # another worker occupies the only import slot
+        with self.registry.cursor() as cr:
+            cr.execute("SELECT pg_advisory_lock(hashtext('automation.channel.root.import'), 0)")
+            try:
+                # all sub channels of the full channel are skipped
+                with patch.object(self.registry['automation.task'], '_channel_acquire', wraps=task_obj._channel_acquire) as acquire:
+                    task, lock = task_obj._task_dequeue()
+                    self.assertEqual(acquire.call_count, 1)
+                self.assertEqual(task, task_mail)
+                self.assertFalse(lock)
+            finally:
+                cr.execute("SELECT pg_advisory_unlock(hashtext('automation.channel.root.import'), 0)")
+
+        # slot is free again
+        task, lock = task_obj._task_dequeue()
+        self.assertEqual(task, task_import)
+        self.assertTrue(lock)
+        task_obj._channel_release(lock)
+
+    def test_automation_queue_dependency(self):
+        task_obj = self.env['automation.task']
+        task_a = task_obj.create({'name': 'A'})
+        task_b = task_obj.create({'name': 'B'})
+        task_join = task_obj.create({'name': 'Join', 'depends_ids': [(6, 0, (task_a | task_b).ids)]})
+
+        # join waits for both parents
+        (task_a | task_b | task_join).action_queue()
+        self.assertEqual(task_join.state, 'wait')
+
+        task_a._process_task()
+        self.assertEqual(task_join.state, 'wait')
+
+        # released after the last parent is done
+        task_b._process_task()
+        self.assertEqual(task_join.state, 'queued')
+        task_obj._process_queue()
+        self.assertEqual(task_join.state, 'done')
+
+    @mute_logger('odoo.addons.automation.models.automation')
+    def test_automation_queue_dependency_failed(self):
+        task_obj = self.env['automation.task']
+        task_a = task_obj.create({'name': 'A'})
+        task_b = task_obj.create({'name': 'B', 'depends_ids': [(6, 0, task_a.ids)]})
+        task_c = task_obj.create({'name': 'C', 'depends_ids': [(6, 0, task_b.ids)]})
+        (task_a | task_b | task_c).action_queue()
+        self.assertEqual(task_c.state, 'wait')
+
+        # dependents of a failed task are canceled
+        with patch.object(self.registry['automation.task'], '_run', side_effect=exceptions.UserError('Failed')):
+            task_a._process_task()
+        self.assertEqual(task_a.state, 'failed')
+        self.assertEqual(task_b.state, 'cancel')
+        self.assertIn('A', task_b.error)
+        self.assertEqual(task_c.state, 'cancel')
+
+    def test_automation_queue_dependency_recover(self):
+        task_obj = self.env['automation.task']
+        task_a = task_obj.create({'name': 'A'})
+        task_b = task_obj.create({'name': 'B', 'depends_ids': [(6, 0, task_a.ids)]})
+
+        # release missed, because the wait was set concurrently
+        task_a.write({'state': 'done'})
+        task_b.write({'state': 'wait'})
+        task_obj._task_recover()
+        self.assertEqual(task_b.state, 'queued')
+
+    def test_automation_retry(self):
+        task = self.env['automation.task'].create({'name': 'Retry', 'max_retries': 1})
+        task.action_queue()
+
+        with patch.object(self.registry['automation.task'], '_run', side_effect=exceptions.UserError('Failed')):
+            # first failure is retried later
+            task._process_task()
+            self.assertEqual(task.state, 'queued')
+            self.assertEqual(task.retry_count, 1)
+            self.assertTrue(task.eta)
+
+            # not due yet
+            self.assertFalse(self.env['automation.task']._task_dequeue()[0])
+            trigger = self.env['ir.cron.trigger'].search([('cron_id', '=', self.env.ref('automation.ir_cron_automation_task').id)], order='id desc', limit=1)
+            self.assertGreater(trigger.call_at, fields.Datetime.now())
+            self.assertGreater(self.env['automation.task']._task_next_due_s(), 0)
+
+            # retry budget exhausted
+            task._process_task()
+            self.assertEqual(task.state, 'failed')
+
+    def test_automation_recover(self):
+        task = self.env['automation.task'].create({'name': 'Orphan'})
+        task.write({'state': 'run', 'worker': 'gone:1/cron'})
+        self.env['automation.task.signal'].create({'task_id': task.id, 'heartbeat': '2000-01-01 00:00:00'})
+
+        # task of the lost worker fails
+        recovered = self.env['automation.task']._task_recover()
+        self.assertIn(task, recovered)
+        self.assertEqual(task.state, 'failed')
+
+    def test_automation_recover_cancel(self):
+        task = self.env['automation.task'].create({'name': 'Orphan', 'max_retries': 1})
+        task.write({'state': 'run', 'worker': 'gone:1/cron'})
+        self.env['automation.task.signal'].create({
+            'task_id': task.id,
+            'heartbeat': '2000-01-01 00:00:00',
+            'cancel_requested': True,
+        })
+
+        # requested cancel wins over the retry
+        recovered = self.env['automation.task']._task_recover()
+        self.assertIn(task, recovered)
+        self.assertEqual(task.state, 'cancel')
+
+    def test_automation_fan_out(self):
+        task_cls = self.registry['automation.task']
+        task = self.env['automation.task'].create({'name': 'Fan Out'})
+
+        def run(self, taskc):
+            taskc.fan_out(list(range(5)), 2, '_run_chunk')
+
+        with patch.object(task_cls, '_run', run), \
+                patch.object(task_cls, '_run_chunk', create=True) as run_chunk:
+            task.action_queue()
+            task._process_task()
+
+            # parent waits for its chunks
+            self.assertEqual(task.state, 'wait')
+            self.assertEqual(len(task.child_ids), 3)
+
+            self.env['automation.task']._process_queue()
+            self.assertEqual(run_chunk.call_count, 3)
+
+        self.assertEqual(task.state, 'done')
+        self.assertEqual(task.progress, 100.0)
+
+    def test_automation_fan_out_singleton(self):
+        task_cls = self.registry['automation.task']
+        task = self.env['automation.task'].create({'name': 'Fan Out Singleton'})
+        task.write({'res_model': 'automation.task', 'res_id': task.id})
+
+        def run(self, taskc):
+            taskc.fan_out(list(range(4)), 2, '_run_chunk')
+
+        with patch.object(task_cls, '_run', run), \
+                patch.object(task_cls, '_run_options', lambda self: {'singleton': True}, create=True), \
+                patch.object(task_cls, '_run_chunk', create=True) as run_chunk:
+            task.action_queue()
+            task._process_task()
+            self.assertEqual(task.state, 'wait')
+
+            # subtasks do not wait for their parent
+            self.env['automation.task']._process_queue()
+            self.assertEqual(run_chunk.call_count, 2)
+
+        self.assertEqual(set(task.child_ids.mapped('state')), {'done'})
+        self.assertEqual(task.state, 'done')
+
+    def test_automation_fan_out_access(self):
+        user = self.env['res.users'].create({
+            'name': 'Automation User',
+            'login': 'automation_fan_out_user',
+            'group_ids': [(4, self.env.ref('automation.group_automation_user').id)],
+        })
+        task = self.env['automation.task'].with_user(user).create({'name': 'Fan Out Access'})
+
+        # users can not turn their tasks into chunks
+        with self.assertRaises(exceptions.AccessError):
+            task.write({'fanout': {'method': 'unlink', 'ids': []}})
+        with self.assertRaises(exceptions.AccessError):
+            task.create({'name': 'Chunk', 'parent_id': task.id})
+
+        # only chunk methods are called
+        with self.assertRaises(exceptions.UserError):
+            task.sudo()._task_fan_out('unlink', [[1]])
+
+    def test_automation_bulk_queue(self):
+        tasks = self.env['automation.task.example']._task_create_queued([
+            {'name': 'Bulk %s' % i} for i in range(10)
+        ])
+        self.assertEqual(set(tasks.mapped('state')), {'queued'})
+        self.assertEqual(set(tasks.mapped('res_model')), {'automation.task.example'})
+        self.assertEqual(tasks[0].task_id.res_id, tasks[0].id)
+
+    def test_automation_bulk_queue_queries(self):
+        example_cls = self.registry['automation.task.example']
+
+        def enqueue(count):
+            records = self.env['automation.task.example'].create([
+                {'name': 'Bulk %s' % i} for i in range(count)
+            ])
+            self.env.flush_all()
+            self.env.invalidate_all()
+            start = self.env.cr.sql_log_count
+            records.task_id.sudo()._task_enqueue()
+            self.env.flush_all()
+            count = self.env.cr.sql_log_count - start
+            self.assertEqual(set(records.mapped('channel')), {'root.bulk'})
+            return count
+
+        # channel overrides of the resources are read in batch
+        with patch.object(example_cls, '_run_options', lambda self: {'channel': 'root.%s' % self.name.split()[0].lower()}, create=True):
+            self.assertEqual(enqueue(2), enqueue(20))
+
+    def test_automation_cleanup(self):
+        task = self.env['automation.task.example'].create({
+            'name': 'Test Task'
+        })
+        task.action_queue()
+        task.task_id._process_task()
+        total_logs = task.total_logs
+
+        # logs are kept on partitioning
+        log_obj = self.env['automation.task.log']
+        self.assertTrue(log_obj._log_partition_enable())
+        self.assertTrue(log_obj._log_is_partitioned())
+        self.assertTrue(log_obj._log_partition_list())
+        task.task_id.invalidate_recordset()
+        self.assertEqual(task.total_logs, total_logs)
+        self.env.cr.execute("SELECT 1 FROM pg_constraint WHERE conname = 'automation_task_log_pkey'")
+        self.assertTrue(self.env.cr.fetchone())
+
+        # logs of a new partition are moved out of the default partition
+        month = fields.Date.today().replace(day=1) + relativedelta(months=12)
+        log = log_obj.search([('task_id', '=', task.task_id.id)], limit=1)
+        self.env.cr.execute("UPDATE automation_task_log SET create_date = %s WHERE id = %s", (month, log.id))
+        log_obj._log_partition_create(month)
+        self.env.cr.execute(f'SELECT id FROM "{log_obj._log_partition_name(month)}"')
+        self.assertEqual(self.env.cr.fetchall(), [(log.id, )])
+
+        # task is removed after retention
+        task.task_id.state_change = '2000-01-01 00:00:00'
+        self.assertEqual(self.env['automation.task']._task_cleanup('done', 30), 1)
+        self.assertFalse(task.exists())
+
+    def test_automation_checkpoint(self):
+        task_cls = self.registry['automation.task']
+        task = self.env['automation.task'].create({'name': 'Checkpoint'})
+        processed = []
+
+        def run(self, taskc):
+            start = taskc.resume_state or 0
+            for i in range(start, 5):
+                processed.append(i)
+                taskc.checkpoint(i + 1)
+                if i == 2 and not start:
+                    raise AutomationTaskRequeueException('Time limit')
+
+        with patch.object(task_cls, '_run', run):
+            task.action_queue()
+            task._process_task()
+
+            # checkpoint survives requeue
+            self.assertEqual(task.state, 'queued')
+            self.assertEqual(task.checkpoint, 3)
+
+            # next run resumes
+            task._process_task()
+
+        self.assertEqual(processed, [0, 1, 2, 3, 4])
+        self.assertEqual(task.state, 'done')
+        self.assertFalse(task.checkpoint)
+
+    def test_automation_cancel(self):
+        task_cls = self.registry['automation.task']
+        task = self.env['automation.task'].create({'name': 'Cancel'})
+
+        def run(self, taskc):
+            taskc.progress('Start', 0)
+            self.action_cancel()
+            taskc.progress('Next', 50)
+            raise AssertionError('Task not canceled')
+
+        with patch.object(task_cls, '_run', run), \
+                patch.object(task_cls, '_run_options', {'cancel_check_s': 0}, create=True):
+            task.action_queue()
+            task._process_task()
+
+        self.assertEqual(task.state, 'cancel')
+
+    def test_automation_cancel_substage(self):
+        task_cls = self.registry['automation.task']
+        task = self.env['automation.task'].create({'name': 'Cancel Substage'})
+
+        def run(self, taskc):
+            taskc.stage('Start')
+            self.action_cancel()
+            taskc.substage('Next')
+            raise AssertionError('Task not canceled')
+
+        with patch.object(task_cls, '_run', run), \
+                patch.object(task_cls, '_run_options', {'cancel_check_s': 0}, create=True):
+            task.action_queue()
+            task._process_task()
+
+        self.assertEqual(task.state, 'cancel')
+
+    def test_automation_log_batch(self):
+        task = self.env['automation.task'].create({'name': 'Batch'})
+        taskc = TaskStatus(task)
+        logs = [{
+            'create_date': fields.Datetime.now(),
+            'task_id': task.id,
+            'stage_id': taskc.stage_id,
+            'pri': 'i',
+            'message': 'Log %s' % i,
+        } for i in range(3)]
+
+        # logs and progress are written at once
+        taskc.flush()
+        taskc._write_batch(self.env.cr, logs, {taskc.stage_id: {'progress': 50.0, 'status': 'Half'}})
+        self.env.invalidate_all()
+        self.assertEqual(task.total_logs, 4)
+        stage = self.env['automation.task.stage'].browse(taskc.stage_id)
+        self.assertEqual(stage.progress, 50.0)
+        self.assertEqual(stage.status, 'Half')
+
+    @mute_logger('odoo.addons.automation.models.status')
+    def test_automation_log_buffer(self):
+        task = self.env['automation.task'].create({'name': 'Buffer'})
+        log_obj = self.env['automation.task.log']
+        taskc = TaskStatus(task, options={'log_buffer_size': 3, 'log_buffer_ms': 60000, 'progress_interval_ms': 60000})
+
+        def count():
+            return log_obj.search_count([('task_id', '=', task.id)])
+
+        # written when the buffer is full
+        taskc.log('Log 1')
+        self.assertEqual(count(), 0)
+        taskc.log('Log 2')
+        self.assertEqual(count(), 3)
+
+        # errors are written immediately
+        taskc.log('Log 3')
+        self.assertEqual(count(), 3)
+        taskc.loge('Error')
+        self.assertEqual(count(), 5)
+
+        # written before a new stage
+        taskc.log('Log 4')
+        taskc.stage('Stage')
+        self.assertEqual(count(), 6)
+
+        # written after the buffer time
+        taskc.log('Log 5')
+        self.assertEqual(count(), 6)
+        taskc._buffer_flush_time -= 60
+        taskc.log('Log 6')
+        self.assertEqual(count(), 8)
+
+        # written on throttled progress after the buffer time
+        taskc.progress('Start', 10)
+        taskc.log('Log 7')
+        self.assertEqual(count(), 8)
+        taskc._buffer_flush_time -= 60
+        taskc.progress('Quiet', 50)
+        self.assertEqual(count(), 9)
+
+    def test_automation_progress_throttle(self):
+        task = self.env['automation.task'].create({'name': 'Throttle'})
+        taskc = TaskStatus(task, options={'progress_interval_ms': 60000})
+
+        with patch.object(taskc, '_post_progress') as post_progress:
+            # only the first progress is written within the interval
+            for i in range(100):
+                taskc.progress('Step %s' % i, i)
+            self.assertEqual(post_progress.call_count, 1)
+
+            # latest progress is written on done
+            taskc.done()
+            self.assertEqual(post_progress.call_count, 2)
+            self.assertEqual(post_progress.call_args[0][0]['progress'], 100)
+
+    def test_automation_shipper(self):
+        session = MagicMock()
+        session.post.side_effect = [requests.ConnectionError('Down'), MagicMock()]
+        shipper = TaskShipper(session, '/automation/batch', 10)
+
+        # failed batch is sent again
+        with patch('odoo.addons.automation.models.status.time.sleep'):
+            shipper.start()
+            shipper.put([{'op': 'log', 'message': 'Log'}])
+            shipper.wait()
+            shipper.stop()
+        self.assertEqual(session.post.call_count, 2)
+        self.assertIsNone(shipper.error)
+
+    def test_automation_log_refs(self):
+        task = self.env['automation.task'].create({'name': 'References'})
+        partner = self.env.ref('base.main_partner')
+        taskc = TaskStatus(task)
+        taskc.log('Partner', ref='res.partner,%s' % partner.id)
+        taskc.log('Missing', ref='res.partner,999999999')
+
+        # logs are created on flush
+        taskc.flush()
+        messages = self.env['automation.task.log'].search([('task_id', '=', task.id)]).mapped('message')
+        self.assertIn("Partner (%s, '%s')" % (partner.id, partner.display_name), messages)
+        self.assertIn('Missing (res.partner,999999999)', messages)
+
+    @mute_logger('odoo.addons.automation.models.status')
+    def test_automation_log_level(self):
+        task = self.env['automation.task'].create({'name': 'Log Level'})
+        taskc = TaskStatus(task, options={'log_level': 'i', 'log_sample': 2})
+        taskc.logd('Debug')
+        for i in range(5):
+            taskc.logw('Missing %s' % i, code='MISSING')
+        taskc.loge('Error', code='MISSING')
+        taskc.close()
+
+        # counters include dropped lines
+        self.assertEqual(taskc.warnings, 5)
+        self.assertEqual(taskc.errors, 1)
+
+        # debug is dropped, sampled lines are summarized
+        logs = self.env['automation.task.log'].search([('task_id', '=', task.id)])
+        self.assertFalse(logs.filtered(lambda l: l.pri == 'd'))
+        missing = logs.filtered(lambda l: l.code == 'MISSING')
+        self.assertEqual(len(missing), 4)
+        self.assertIn({'dropped': 3}, missing.mapped('data'))
+
+    def test_automation_log_aggregate(self):
+        task = self.env['automation.task'].create({'name': 'Aggregate'})
+        partners = self.env['res.partner'].search([], limit=3)
+        taskc = TaskStatus(task, options={'log_aggregate': True})
+        taskc.stage('Check')
+        for _i in range(20):
+            for partner in partners:
+                taskc.logw('Missing VAT', obj=partner, code='VAT')
+        taskc.done()
+
+        # one log per stage, priority and code
+        log = self.env['automation.task.log'].search([('task_id', '=', task.id), ('code', '=', 'VAT')])
+        self.assertEqual(len(log), 1)
+        self.assertEqual(log.count, 20 * len(partners))
+        self.assertEqual(len(log.data['refs']), min(20 * len(partners), 10))
+        self.assertEqual(task.total_warnings, 20 * len(partners))
+
+    def test_automation_log_capture(self):
+        task = self.env['automation.task'].create({'name': 'Capture'})
+        with TaskStatus(task) as taskc, mute_logger('odoo.addons.automation.tests'):
+            logging.getLogger('odoo.addons.automation.tests').warning('Not enabled')
+        self.assertEqual(taskc.warnings, 0)
+
+        with TaskStatus(task, options={'log_capture': True}) as taskc:
+            logging.getLogger('odoo.addons.automation.tests').warning('Captured %s', 1)
+            logging.getLogger('odoo.addons.automation.tests').info('Not captured')
+
+        # warnings are forwarded into the task log
+        messages = self.env['automation.task.log'].search([('task_id', '=', task.id)]).mapped('message')
+        self.assertIn('Captured 1', messages)
+        self.assertNotIn('Not captured', messages)
+        self.assertNotIn('Not enabled', messages)
+        self.assertEqual(taskc.warnings, 1)
+
+    def test_automation_log_spill(self):
+        task = self.env['automation.task'].create({'name': 'Log Spill'})
+        taskc = TaskStatus(task, options={'log_spill': True})
+        for i in range(10):
+            taskc.log('Line %s' % i)
+        taskc.logw('Warning')
+        taskc.close()
+
+        # info lines are written to the attached file
+        attachment = task.spill_attachment_id
+        self.assertTrue(attachment.store_fname)
+        self.assertGreater(attachment.file_size, 0)
+        self.assertEqual(attachment.mimetype, 'application/gzip')
+        with gzip.open(attachment._full_path(attachment.store_fname), 'rt') as spill:
+            lines = [json.loads(line) for line in spill]
+        self.assertEqual(len(lines), 11)
+        self.assertEqual(lines[-1]['message'], 'Line 9')
+
+        # warnings and the summary are kept in the database
+        messages = self.env['automation.task.log'].search([('task_id', '=', task.id)]).mapped('message')
+        self.assertIn('Warning', messages)
+        self.assertIn('11 messages written to the log file', messages)
+        self.assertNotIn('Line 0', messages)
+
+        # log file is removed with the task
+        task.write({'state': 'done', 'state_change': '2000-01-01 00:00:00'})
+        self.env['automation.task']._task_cleanup('done', 30)
+        self.assertFalse(attachment.exists())
+
+    @mute_logger('odoo.addons.automation.models.automation')
+    def test_automation_log_spill_failed(self):
+        task_cls = self.registry['automation.task']
+        task = self.env['automation.task'].create({'name': 'Log Spill Failed'})
+
+        def run(self, taskc):
+            taskc.log('Before the failure')
+            raise exceptions.UserError('Failed')
+
+        with patch.object(task_cls, '_run', run), \
+                patch.object(task_cls, '_run_options', {'log_spill': True}, create=True):
+            task.action_queue()
+            task._process_task()
+
+        # log file of the failed task is attached
+        self.assertEqual(task.state, 'failed')
+        attachment = task.spill_attachment_id
+        self.assertTrue(attachment.store_fname)
+        with gzip.open(attachment._full_path(attachment.store_fname), 'rt') as spill:
+            lines = [json.loads(line) for line in spill]
+        self.assertEqual(lines[0]['message'], 'Before the failure')
+
+    def test_automation_stage_timing(self):
+        task = self.env['automation.task'].create({'name': 'Timing'})
+        taskc = TaskStatus(task, options={'profile_stages': True})
+        taskc.stage('Read')
+        self.env['res.partner'].search([]).mapped('name')
+        taskc.done()
+        taskc.close()
+
+        # stages and the task are measured
+        stage = self.env['automation.task.stage'].search([('task_id', '=', task.id), ('name', '=', 'Read')])
+        self.assertTrue(stage.date_start)
+        self.assertTrue(stage.date_end)
+        self.assertGreater(stage.sql_count, 0)
+        self.assertGreaterEqual(stage.wall_time, 0.0)
+        task.invalidate_recordset()
+        self.assertGreaterEqual(task.sql_count, stage.sql_count)
+
+        # the profile is logged on the stage
+        profile = self.env['automation.task.log'].search([('stage_id', '=', stage.id), ('code', '=', 'PROFILE')])
+        self.assertTrue(profile)
+
+    def test_automation_memory_limit(self):
+        task = self.env['automation.task'].create({'name': 'Memory'})
+        taskc = TaskStatus(task, options={'max_memory_mb': 1000, 'memory_check_s': 0})
+        taskc.loop_init(3)
+
+        # memory freed by clearing the cache
+        with patch.object(TaskStatus, '_memory_mb', side_effect=[2000, 500]):
+            taskc.loop_next()
+
+        # still above the limit after clearing the cache
+        with patch.object(TaskStatus, '_memory_mb', side_effect=[2000, 1500]):
+            with self.assertRaises(AutomationTaskRequeueException):
+                taskc.loop_next()
+        self.assertEqual(taskc.warnings, 1)
+
+    def test_automation_memory_limit_queue(self):
+        task_cls = self.registry['automation.task']
+        tasks = self.env['automation.task'].create([{'name': 'Memory %s' % i} for i in range(2)])
+        tasks.action_queue()
+
+        def run(self, taskc):
+            taskc.loop_init(1)
+            taskc.loop_next()
+
+        # the queue is not drained further after a memory requeue
+        with patch.object(task_cls, '_run', run), \
+                patch.object(TaskStatus, '_memory_mb', return_value=2000), \
+                patch.object(task_cls, '_run_options', lambda self: {'max_memory_mb': 1000, 'memory_check_s': 0}, create=True):
+            self.assertEqual(self.env['automation.task']._process_queue(), 1)
+            self.assertEqual(set(tasks.mapped('state')), {'queued'})
+
+            # fails after the memory requeues are exhausted
+            self.env['ir.config_parameter'].sudo().set_param('automation.max_memory_requeues', 1)
+            task = tasks.filtered('memory_requeue_count')
+            self.assertEqual(task.memory_requeue_count, 1)
+            task.eta = False
+            task._process_task()
+            self.assertEqual(task.state, 'failed')
+            self.assertEqual(task.memory_requeue_count, 2)
+
+
+@tagged('post_install', '-at_install')
+class TestAutomationHttp(HttpCase):
+    ''' Automation remote logging '''
+
+    def test_automation_batch(self):
+        task = self.env['automation.task'].create({'name': 'Remote'})
+        token = self.env['automation.task.token'].create({'task_id': task.id})
+        stage = self.env['automation.task.stage'].create({'task_id': task.id, 'name': 'Remote'})
+
+        ops = [{'op': 'log', 'task_id': task.id, 'stage_id': stage.id, 'pri': 'i', 'message': 'Log %s' % i} for i in range(3)]
+        ops.append({'op': 'progress', 'stage_id': stage.id, 'progress': 50.0, 'status': 'Half'})
+        ops.append({'op': 'stage', 'task_id': task.id, 'parent_id': stage.id, 'name': 'Substage'})
+        res = self.url_open('/automation/batch', data=json.dumps(ops), headers={
+            'Content-Type': 'application/json',
+            'X-Automation-Token': token.token,
+            'X-Automation-DB': self.env.cr.dbname,
+        })
+        res.raise_for_status()
+
+        # logs are created at once, progress returns no id
+        results = res.json()
+        self.env.invalidate_all()
+        self.assertEqual(len(results), 5)
+        self.assertIsNone(results[3])
+        self.assertEqual(task.total_logs, 3)
+        self.assertEqual(stage.progress, 50.0)
+        self.assertEqual(task.total_stages, 2)
+
+        # operations of other tasks are rejected
+        other_task = self.env['automation.task'].create({'name': 'Other'})
+        other_stage = self.env['automation.task.stage'].create({'task_id': other_task.id, 'name': 'Other'})
+        for op in (
+            {'op': 'log', 'task_id': other_task.id, 'stage_id': other_stage.id, 'pri': 'i', 'message': 'Other'},
+            {'op': 'progress', 'stage_id': other_stage.id, 'progress': 50.0},
+        ):
+            res = self.url_open('/automation/batch', data=json.dumps([op]), headers={
+                'Content-Type': 'application/json',
+                'X-Automation-Token': token.token,
+                'X-Automation-DB': self.env.cr.dbname,
+            })
+            self.assertEqual(res.status_code, 403)
+
+    def test_automation_stage_reserve(self):
+        task = self.env['automation.task'].create({'name': 'Remote'})
+        token = self.env['automation.task.token'].create({'task_id': task.id})
+        headers = {
+            'X-Automation-Token': token.token,
+            'X-Automation-DB': self.env.cr.dbname,
+        }
+        res = self.url_open('/automation/stage/reserve', data={'count': 2}, headers=headers)
+        res.raise_for_status()
+        stage_ids = res.json()
+        self.assertEqual(len(stage_ids), 2)
 
+        # stage is created with the reserved id
+        ops = [{'op': 'stage', 'id': stage_ids[0], 'task_id': task.id, 'name': 'Reserved'}]
+        res = self.url_open('/automation/batch', data=json.dumps(ops), headers=dict(headers, **{'Content-Type': 'application/json'}))
+        res.raise_for_status()
+        self.assertEqual(res.json(), [stage_ids[0]])
+        self.assertTrue(self.env['automation.task.stage'].browse(stage_ids[0]).exists())
@@ -9,4 +9,106 @@ class ResConfigSettings(models.TransientModel):
         config_parameter='automation.task_unqueued_run',
         default=False,
         help="Allow tasks to run without queueing"
-    )
\ No newline at end of file
+    )
+
+    automation_cron_time_budget_s = fields.Integer(
+        string='Cron Time Budget (s)',
+        config_parameter='automation.cron_time_budget_s',
+        default=60,
+        help="How long the scheduled action keeps processing queued tasks "
+             "before it stops and waits for its next run."
+    )
+
+    automation_channels = fields.Char(
+        string='Channels',
+        config_parameter='automation.channels',
+        help="Maximum number of tasks running at the same time per channel, "
+             "e.g. root:4,root.import:2,root.mail:1. Channels without limit run unlimited."
+    )
+
+    automation_retry_delay_s = fields.Integer(
+        string='Retry Delay (s)',
+        config_parameter='automation.retry_delay_s',
+        default=60,
+        help="Waiting time before a failed task is started again, it doubles with every retry."
+    )
+
+    automation_requeue_delay_s = fields.Integer(
+        string='Requeue Delay (s)',
+        config_parameter='automation.requeue_delay_s',
+        default=10,
+        help="Waiting time before a task, which paused itself after its time limit, continues."
+    )
+
+    automation_worker_timeout_s = fields.Integer(
+        string='Worker Timeout (s)',
+        config_parameter='automation.worker_timeout_s',
+        default=600,
+        help="A running task, whose server process did not report back within this time, "
+             "is started again or set to failed."
+    )
+
+    automation_max_memory_mb = fields.Integer(
+        string='Memory Limit (MB)',
+        config_parameter='automation.max_memory_mb',
+        help="A task, whose server process uses more memory, pauses itself and continues "
+             "where it stopped. Leave empty for no limit."
+    )
+
+    automation_max_memory_requeues = fields.Integer(
+        string='Memory Requeues',
+        config_parameter='automation.max_memory_requeues',
+        default=3,
+        help="How often a task pauses itself after the memory limit was reached, before it fails."
+    )
+
+    automation_log_partitioned = fields.Boolean(
+        string='Partitioned Logs',
+        config_parameter='automation.log_partitioned',
+        default=False,
+        help="Store logs split by month, so that old logs can be removed at once. "
+             "The logs are converted by the daily cleanup."
+    )
+
+    automation_log_retention_days = fields.Integer(
+        string='Log Retention (days)',
+        config_parameter='automation.log_retention_days',
+        help="Logs older than this are removed by the daily cleanup."
+    )
+
+    automation_retention_done_days = fields.Integer(
+        string='Done Task Retention (days)',
+        config_parameter='automation.retention_done_days',
+        help="Finished tasks are removed with their logs after this time. "
+             "With partitioned logs, tasks are kept until their logs are removed."
+    )
+
+    automation_retention_failed_days = fields.Integer(
+        string='Failed Task Retention (days)',
+        config_parameter='automation.retention_failed_days',
+        help="Failed tasks are removed with their logs after this time. "
+             "With partitioned logs, tasks are kept until their logs are removed."
+    )
+
+    automation_log_level = fields.Selection(
+        [
+            ("x", "Emergency"),
+            ("a", "Alert"),
+            ("e", "Error"),
+            ("w", "Warning"),
+            ("n", "Notice"),
+            ("i", "Info"),
+            ("d", "Debug"),
+        ],
+        string='Log Level',
+        config_parameter='automation.log_level',
+        default='d',
+        help="Only messages of this or a higher priority are stored with the task."
+    )
+
+    automation_log_sample = fields.Integer(
+        string='Log Sample',
+        config_parameter='automation.log_sample',
+        help="Only the first messages of the same kind are stored, "
+             "for the others only their number is stored. Errors are always stored."
+    )
@@ -0,0 +1,17 @@
+# pylint: disable=manifest-required-author
+# pylint: disable=missing-readme
+{
+    'name': 'Automation Benchmark',
+    'version': '19.0.1.0.0',
+    'summary': 'Throughput Benchmark for the Automation Framework',
+    'category': 'Automation',
+    'author': 'martin-reisenhofer',
+    'maintainers': ['martin-reisenhofer'],
+    'website': 'https://github.com/oerp-at',
+    'license': 'LGPL-3',
+    'depends': ['automation'],
+    'data': [
+        'security/ir.model.access.csv'
+    ],
+    'installable': True
+}
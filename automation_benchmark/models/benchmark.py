@@ -0,0 +1,109 @@
+import time
+import logging
+from odoo import api, fields, models, sql_db
+
+_logger = logging.getLogger(__name__)
+
+
+def _percentile(values, pct):
+    """ :return: nearest rank percentile of the values """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = max(int(round(pct / 100.0 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+class AutomationBenchmarkTask(models.Model):
+    _name = "automation.benchmark.task"
+    _description = "Automation Benchmark Task"
+    _inherit = "automation.task.mixin"
+
+    mode = fields.Selection([
+        ("local", "Local"),
+        ("cursor", "Second Cursor"),
+        ("token", "Token"),
+    ], required=True, default="cursor")
+
+    stage_count = fields.Integer("Stages", default=1)
+    log_count = fields.Integer("Logs per Stage", default=100)
+    progress_count = fields.Integer("Progress Updates per Stage", default=10)
+
+    enqueue_time = fields.Float(readonly=True)
+    start_time = fields.Float(readonly=True)
+    end_time = fields.Float(readonly=True)
+    bench_sql_count = fields.Integer("Benchmark SQL Statements", readonly=True)
+
+    def _run_options(self):
+        return {
+            "stages": self.stage_count,
+            "local": self.mode == "local",
+            "token": self.mode == "token",
+        }
+
+    def _run(self, taskc):
+        """ Emit the configured stages, logs and progress updates """
+        self.ensure_one()
+        start_time = time.time()
+        sql_start = sql_db.sql_counter
+
+        progress_step = max(self.log_count // self.progress_count, 1) if self.progress_count else 0
+        for stage in range(1, self.stage_count + 1):
+            taskc.stage(f"Stage {stage}")
+            taskc.loop_init(self.progress_count)
+            for i in range(1, self.log_count + 1):
+                taskc.log(f"Log {i}", code="BENCHMARK", data={"stage": stage, "log": i})
+                if progress_step and i % progress_step == 0:
+                    taskc.loop_next()
+            taskc.done()
+
+        self.write({
+            "start_time": start_time,
+            "end_time": time.time(),
+            "bench_sql_count": sql_db.sql_counter - sql_start,
+        })
+
+    @api.model
+    def _benchmark_run(self, mode="cursor", tasks=10, stages=1, logs=100, progress=10):
+        """ Queue and process synthetic tasks
+            :return: dict with tasks/s, logs/s, p50/p99 latency from
+                enqueue to start and SQL statements per log
+        """
+        task_obj = self.env["automation.task"]
+        cr = self.env.cr
+        records = self._task_create_queued([{
+            "name": f"Benchmark {mode} {i}",
+            "mode": mode,
+            "stage_count": stages,
+            "log_count": logs,
+            "progress_count": progress,
+            "enqueue_time": time.time(),
+        } for i in range(1, tasks + 1)])
+        task_obj._commit_state()
+
+        # process only the benchmark tasks, tasks
+        # claimed by workers meanwhile are skipped
+        for task in records.task_id:
+            cr.execute("SELECT id FROM automation_task WHERE id = %s AND state = 'queued' FOR UPDATE SKIP LOCKED", (task.id, ))
+            if cr.fetchone():
+                task._process_task()
+        records.invalidate_recordset()
+        records = records.filtered(lambda r: r.state == "done")
+        if not records:
+            return {}
+
+        duration_s = max(records.mapped("end_time")) - min(records.mapped("start_time"))
+        log_count = sum(r.stage_count * r.log_count for r in records)
+        latencies_ms = [(r.start_time - r.enqueue_time) * 1000.0 for r in records]
+        result = {
+            "mode": mode,
+            "tasks": len(records),
+            "logs": log_count,
+            "tasks_per_s": round(len(records) / duration_s, 2) if duration_s else 0.0,
+            "logs_per_s": round(log_count / duration_s, 2) if duration_s else 0.0,
+            "latency_p50_ms": round(_percentile(latencies_ms, 50), 2),
+            "latency_p99_ms": round(_percentile(latencies_ms, 99), 2),
+            "sql_per_log": round(sum(records.mapped("bench_sql_count")) / log_count, 2) if log_count else 0.0,
+        }
+        _logger.info("Benchmark %s", result)
+        return result
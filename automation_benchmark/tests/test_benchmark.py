@@ -0,0 +1,15 @@
+from odoo.tests.common import TransactionCase
+from odoo.tests import tagged
+
+
+@tagged('post_install', '-at_install', 'benchmark', '-standard')
+class TestBenchmark(TransactionCase):
+    ''' Automation Benchmark, run with --test-tags benchmark '''
+
+    def test_benchmark_local(self):
+        result = self.env['automation.benchmark.task']._benchmark_run(
+            mode='local', tasks=5, stages=2, logs=50, progress=10)
+        self.assertEqual(result['tasks'], 5)
+        self.assertEqual(result['logs'], 500)
+        self.assertGreater(result['logs_per_s'], 0)
+        self.assertGreaterEqual(result['latency_p99_ms'], result['latency_p50_ms'])
@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+import signal
+import logging
+import selectors
+import threading
+import multiprocessing
+
+import psutil
+import odoo
+from odoo import SUPERUSER_ID
+
+from . import Command
+from .assemble import CommandMixin
+
+
+_logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'automation_task'
+DEFAULT_POLL_INTERVAL = 60
+
+
+def run_worker(db_name, poll_interval):
+    """ Worker process, drains the queue and sleeps until a task
+        is queued or finished (NOTIFY), the next delayed task
+        is due or the poll interval passed """
+
+    stop_event = threading.Event()
+
+    def stop_handler(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop_handler)
+    signal.signal(signal.SIGINT, stop_handler)
+
+    # signals wake up the selector over the pipe
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+
+    memory_limit = odoo.tools.config['limit_memory_soft']
+    process = psutil.Process()
+
+    threading.current_thread().dbname = db_name
+    registry = odoo.modules.registry.Registry(db_name)
+
+    with odoo.sql_db.db_connect(db_name).cursor() as listen_cr:
+        conn = listen_cr._cnx
+        listen_cr.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        listen_cr.commit()
+
+        sel = selectors.DefaultSelector()
+        sel.register(conn, selectors.EVENT_READ)
+        sel.register(wakeup_r, selectors.EVENT_READ)
+        while not stop_event.is_set():
+            # process queued tasks, return after poll interval
+            # to check the stop flag between tasks
+            with registry.cursor() as cr:
+                env = odoo.api.Environment(cr, SUPERUSER_ID, {})
+                processed = env['automation.task']._process_queue(time_budget_s=poll_interval)
+                max_memory_mb = env['ir.config_parameter'].sudo().get_param('automation.max_memory_mb')
+                # wake up when the next delayed task is due
+                timeout = poll_interval
+                next_due_s = env['automation.task']._task_next_due_s()
+                if next_due_s is not None:
+                    timeout = min(timeout, next_due_s)
+
+            # exit after the memory limit of odoo, or of the tasks
+            # is reached, the worker is restarted with a fresh process
+            limits = [limit for limit in (memory_limit, int(max_memory_mb or 0) * 1024 * 1024) if limit]
+            if limits and process.memory_info().rss > min(limits):
+                _logger.info('Automation worker %s reached the memory limit', os.getpid())
+                break
+
+            # wait for notification if queue is empty
+            if not processed and not stop_event.is_set():
+                for key, _events in sel.select(timeout):
+                    if key.fileobj is conn:
+                        conn.poll()
+                        conn.notifies.clear()
+                    else:
+                        os.read(wakeup_r, 512)
+
+    _logger.info('Automation worker %s stopped', os.getpid())
+
+
+class Automation_Worker(CommandMixin, Command):
+    """ Run Automation Task Worker """
+
+    def __init__(self):
+        super(Automation_Worker, self).__init__()
+        self.parser.add_argument(
+            "--concurrency",
+            metavar="CONCURRENCY",
+            type=int,
+            default=2,
+            envvar=True,
+            help="Number of worker processes")
+        self.parser.add_argument(
+            "--poll-interval",
+            name="poll_interval",
+            metavar="POLL_INTERVAL",
+            type=int,
+            default=DEFAULT_POLL_INTERVAL,
+            envvar=True,
+            help="Seconds to wait for a notification before polling the queue")
+
+        self.stopping = False
+        # workers use the config parsed by this process
+        self.mp_context = multiprocessing.get_context("fork")
+
+    def _start_worker(self, index):
+        process = self.mp_context.Process(
+            target=run_worker,
+            args=(self.params.database, self.params.poll_interval),
+            name=f"automation-worker-{index}")
+        process.start()
+        _logger.info('Automation worker %s started (pid %s)', index, process.pid)
+        return process
+
+    def run_config(self):
+        if not self.params.database:
+            _logger.error("No database defined for the automation worker!")
+            sys.exit(1)
+
+        def stop_handler(signum, frame):
+            self.stopping = True
+
+        signal.signal(signal.SIGTERM, stop_handler)
+        signal.signal(signal.SIGINT, stop_handler)
+
+        # start workers and restart them if they died
+        workers = [self._start_worker(i) for i in range(self.params.concurrency)]
+        while not self.stopping:
+            for i, process in enumerate(workers):
+                if not process.is_alive():
+                    if process.exitcode:
+                        _logger.warning('Automation worker %s died (exit code %s), restarting...', i, process.exitcode)
+                    else:
+                        _logger.info('Automation worker %s exited, restarting...', i)
+                    workers[i] = self._start_worker(i)
+            time.sleep(1)
+
+        # stop gracefully, running tasks are finished
+        _logger.info('Stopping automation workers...')
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+        for process in workers:
+            process.join()